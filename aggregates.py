@@ -0,0 +1,310 @@
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from zoneinfo import ZoneInfo
+
+import utils
+
+LOCAL_TZ = ZoneInfo("Europe/Vilnius")
+
+
+def calendar_features(time_index: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Local time features used by the metrics, same as of HistAnalysis.processing() (see utils.calendar_for_index):
+    daytime flag (hours 8-20 inclusive) and weekend id
+    :param time_index: tz-aware pd.DatetimeIndex
+    :return: pd.DataFrame with is_daytime (bool) and weekend_id (Monday-Sunday week number, -1 for workdays)
+    """
+    calendar = utils.calendar_for_index(time_index)
+    return pd.DataFrame({
+        'is_daytime': calendar['Time_LT_is_daytime'],
+        'weekend_id': np.where(calendar['Time_LT_is_weekend'], calendar['Time_LT_week'], -1),
+    }, index=time_index)
+
+
+class MetricsAggregator:
+    """
+    Incremental version of HistAnalysis.get_mean_metrics.
+    Keeps running sums and counts per station and day/night bucket plus weekends with precipitation,
+    so each new batch of observations is added in O(batch) instead of rescanning the whole history.
+    Stream is treated as append-only per station: observations not newer than the last one seen are skipped,
+    so re-fetched incomplete days are not counted twice.
+    """
+    def __init__(self):
+        self.state = {}  # station_code -> running sums and counts
+
+    @staticmethod
+    def _empty_state() -> dict:
+        return {
+            'temp_sum_day': 0.0, 'temp_count_day': 0,
+            'temp_sum_night': 0.0, 'temp_count_night': 0,
+            'humid_sum': 0.0, 'humid_count': 0,
+            'weekends_w_precip': [],
+            'last_time': None,
+        }
+
+    def update(self, df_batch: pd.DataFrame):
+        """
+        Adds batch of observations
+        :param df_batch: observations (see DataMeteo.historic_data) with station_code column,
+            or long format frame indexed by (station_code, time)
+        :return: self
+        """
+        if isinstance(df_batch.index, pd.MultiIndex):
+            df_batch = df_batch.reset_index(level=0)
+
+        for station_code, df_station in df_batch.groupby('station_code', sort=False, observed=True):
+            state = self.state.setdefault(station_code, self._empty_state())
+            if state['last_time'] is not None:
+                df_station = df_station.loc[df_station.index > pd.Timestamp(state['last_time'])]
+            if df_station.empty:
+                continue
+
+            features = calendar_features(df_station.index)
+            is_daytime = features['is_daytime'].to_numpy()
+            temp = df_station['airTemperature'].to_numpy(dtype='float64', na_value=np.nan)
+            humid = df_station['relativeHumidity'].to_numpy(dtype='float64', na_value=np.nan)
+            precip = df_station['precipitation'].to_numpy(dtype='float64', na_value=np.nan)
+
+            temp_valid = ~np.isnan(temp)
+            state['temp_sum_day'] += float(temp[temp_valid & is_daytime].sum())
+            state['temp_count_day'] += int((temp_valid & is_daytime).sum())
+            state['temp_sum_night'] += float(temp[temp_valid & ~is_daytime].sum())
+            state['temp_count_night'] += int((temp_valid & ~is_daytime).sum())
+
+            humid_valid = ~np.isnan(humid)
+            state['humid_sum'] += float(humid[humid_valid].sum())
+            state['humid_count'] += int(humid_valid.sum())
+
+            weekend_id = features['weekend_id'].to_numpy()
+            weekends_w_precip = np.unique(weekend_id[(weekend_id >= 0) & (precip > 0)])
+            state['weekends_w_precip'] = sorted(set(state['weekends_w_precip']).union(weekends_w_precip.tolist()))
+
+            state['last_time'] = df_station.index.max().isoformat()
+        return self
+
+    def get_mean_metrics(self) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame indexed by station_code with the metrics of HistAnalysis.get_mean_metrics
+        """
+        rows = {}
+        for station_code, state in self.state.items():
+            temp_sum = state['temp_sum_day'] + state['temp_sum_night']
+            temp_count = state['temp_count_day'] + state['temp_count_night']
+            rows[station_code] = {
+                'temp_mean': _mean(temp_sum, temp_count),
+                'temp_mean_day': _mean(state['temp_sum_day'], state['temp_count_day']),
+                'temp_mean_night': _mean(state['temp_sum_night'], state['temp_count_night']),
+                'humid_mean': _mean(state['humid_sum'], state['humid_count']),
+                'n_weekends_w_precip': len(state['weekends_w_precip']),
+            }
+        return pd.DataFrame.from_dict(rows, orient='index').rename_axis('station_code')
+
+    def save(self, path: str):
+        """
+        Saves aggregator state to json
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        path_tmp = f"{path}.{os.getpid()}.tmp"
+        with open(path_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(path_tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads aggregator state saved with save(), returns empty aggregator if the file does not exist
+        """
+        aggregator = cls()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                aggregator.state = json.load(f)
+        return aggregator
+
+
+class RollupIndex:
+    """
+    Daily rollups of the mean metrics with cumulative sums per station, so metrics of any
+    [date_from, date_to] window (local dates) are answered in constant time without filtering the history.
+    Weekly and monthly rollups are derived from the same cumulative sums.
+    """
+    _sums = ['temp_sum_day', 'temp_count_day', 'temp_sum_night', 'temp_count_night', 'humid_sum', 'humid_count',
+             'rainy_saturday', 'rainy_sunday_only']
+
+    def __init__(self, df_hist: pd.DataFrame):
+        """
+        :param df_hist: observations (see DataMeteo.historic_data) with station_code column,
+            or long format frame indexed by (station_code, time)
+        """
+        if isinstance(df_hist.index, pd.MultiIndex):
+            df_hist = df_hist.reset_index(level=0)
+
+        self.daily = {}  # station_code -> pd.DataFrame of daily sums with dense pd.DatetimeIndex of local dates
+        self.cumsum = {}  # station_code -> {sum name: np.array of len(days) + 1}
+        self._rollups = {}
+
+        for station_code, df_station in df_hist.groupby('station_code', sort=False, observed=True):
+            daily = self._daily_sums(df_station)
+            self.daily[station_code] = daily
+            self.cumsum[station_code] = {
+                name: np.concatenate([[0], np.cumsum(daily[name].to_numpy())]) for name in self._sums
+            }
+
+    @staticmethod
+    def _daily_sums(df_station: pd.DataFrame) -> pd.DataFrame:
+        features = calendar_features(df_station.index)
+        temp = df_station['airTemperature'].to_numpy(dtype='float64', na_value=np.nan)
+        humid = df_station['relativeHumidity'].to_numpy(dtype='float64', na_value=np.nan)
+        precip = df_station['precipitation'].to_numpy(dtype='float64', na_value=np.nan)
+        is_daytime = features['is_daytime'].to_numpy()
+        temp_valid = ~np.isnan(temp)
+
+        df = pd.DataFrame({
+            'temp_sum_day': np.where(temp_valid & is_daytime, temp, 0),
+            'temp_count_day': temp_valid & is_daytime,
+            'temp_sum_night': np.where(temp_valid & ~is_daytime, temp, 0),
+            'temp_count_night': temp_valid & ~is_daytime,
+            'humid_sum': np.nan_to_num(humid),
+            'humid_count': ~np.isnan(humid),
+            'is_rainy': precip > 0,
+        }, index=df_station.index.tz_convert(LOCAL_TZ).normalize().tz_localize(None))
+        daily = df.groupby(level=0).sum()
+        daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq='D'), fill_value=0)
+
+        # Weekend is counted once: by its Saturday, or by its Sunday if Saturday had no precipitation
+        is_rainy = daily['is_rainy'].to_numpy() > 0
+        rainy_day_before = np.concatenate([[False], is_rainy[:-1]])
+        daily['rainy_saturday'] = is_rainy & (daily.index.dayofweek == 5)
+        daily['rainy_sunday_only'] = is_rainy & (daily.index.dayofweek == 6) & ~rainy_day_before
+        daily['rainy_sunday_after_rainy_saturday'] = is_rainy & (daily.index.dayofweek == 6) & rainy_day_before
+        return daily
+
+    def _station(self, station_code):
+        if station_code is None:
+            if len(self.daily) != 1:
+                raise ValueError("station_code must be defined for multi-station RollupIndex")
+            station_code = next(iter(self.daily))
+        return station_code
+
+    def query(self, date_from, date_to, station_code: str = None) -> dict:
+        """
+        Metrics of the window in O(1)
+        :param date_from: lower range of date range(inclusive, local date)
+        :param date_to: upper range of date range(inclusive, local date)
+        :param station_code: required if index holds several stations
+        :return: dict with temp_mean, temp_mean_day, temp_mean_night, humid_mean, n_weekends_w_precip
+        """
+        station_code = self._station(station_code)
+        daily = self.daily[station_code]
+        cumsum = self.cumsum[station_code]
+
+        first_day = daily.index[0]
+        position_from = min(max((pd.Timestamp(date_from) - first_day).days, 0), len(daily))
+        position_to = min((pd.Timestamp(date_to) - first_day).days + 1, len(daily))
+        position_to = max(position_to, position_from)
+
+        sums = {name: cumsum[name][position_to] - cumsum[name][position_from] for name in self._sums}
+
+        n_weekends_w_precip = int(sums['rainy_saturday'] + sums['rainy_sunday_only'])
+        # Sunday at the window start is not counted by its Saturday, which is outside the window
+        if position_from < position_to and daily['rainy_sunday_after_rainy_saturday'].iat[position_from]:
+            n_weekends_w_precip += 1
+
+        return {
+            'temp_mean': _mean(sums['temp_sum_day'] + sums['temp_sum_night'],
+                               sums['temp_count_day'] + sums['temp_count_night']),
+            'temp_mean_day': _mean(sums['temp_sum_day'], sums['temp_count_day']),
+            'temp_mean_night': _mean(sums['temp_sum_night'], sums['temp_count_night']),
+            'humid_mean': _mean(sums['humid_sum'], sums['humid_count']),
+            'n_weekends_w_precip': n_weekends_w_precip,
+        }
+
+    def rollup(self, freq: str = 'D', station_code: str = None) -> pd.DataFrame:
+        """
+        Metrics per period, computed once and cached
+        :param freq: 'D' (daily), 'W' (ISO weeks) or 'M' (months)
+        :param station_code: required if index holds several stations
+        :return: pd.DataFrame indexed by period start date
+        """
+        station_code = self._station(station_code)
+        key = (station_code, freq)
+        if key not in self._rollups:
+            days = self.daily[station_code].index
+            period_starts = days.to_period({'D': 'D', 'W': 'W-SUN', 'M': 'M'}[freq]).unique()
+            self._rollups[key] = pd.DataFrame(
+                [self.query(period.start_time, period.end_time.normalize(), station_code) for period in period_starts],
+                index=pd.DatetimeIndex([period.start_time for period in period_starts], name='period_start'))
+        return self._rollups[key]
+
+
+def forecast_skill(df_vintages: pd.DataFrame, df_hist: pd.DataFrame, variable: str = 'airTemperature',
+                   place_stations: dict = None, by_place: bool = False) -> pd.DataFrame:
+    """
+    Forecast skill by lead time: every forecast vintage is joined against observations in one pass
+    :param df_vintages: forecast vintages (see storage.ForecastArchive.read) indexed by forecastTimeUtc,
+        with forecastCreationTimeUtc and place_code columns
+    :param df_hist: observations with station_code column, or long format frame indexed by (station_code, time)
+    :param variable: variable to score, e.g. 'airTemperature'
+    :param place_stations: {place_code: station_code} pairs to compare (e.g. from LocationCatalog.nearest_stations),
+        by default every place is compared with the only station of df_hist
+    :param by_place: score each place separately
+    :return: pd.DataFrame indexed by lead_hours (and place_code) with mae, bias and n
+    """
+    if isinstance(df_hist.index, pd.MultiIndex):
+        df_hist = df_hist.reset_index(level=0)
+
+    forecast_time = df_vintages.index.tz_convert('UTC').as_unit('ns')
+    forecasts = pd.DataFrame({
+        'time': forecast_time,
+        'place_code': df_vintages['place_code'].astype(str).to_numpy() if 'place_code' in df_vintages else None,
+        'forecast': df_vintages[variable].to_numpy(dtype='float64', na_value=np.nan),
+    })
+    creation_time = pd.DatetimeIndex(df_vintages['forecastCreationTimeUtc']).tz_convert('UTC').as_unit('ns')
+    lead_ns = forecast_time.asi8 - creation_time.asi8
+    forecasts['lead_hours'] = np.ceil(lead_ns / 3.6e12).astype('int64')
+
+    observed = pd.DataFrame({
+        'time': df_hist.index.tz_convert('UTC').as_unit('ns'),
+        'station_code': df_hist['station_code'].astype(str).to_numpy(),
+        'observed': df_hist[variable].to_numpy(dtype='float64', na_value=np.nan),
+    })
+
+    if place_stations is not None:
+        forecasts['station_code'] = forecasts['place_code'].map(place_stations)
+        on = ['station_code', 'time']
+    else:
+        if observed['station_code'].nunique() > 1:
+            raise ValueError("place_stations must be defined for multi-station observations")
+        on = ['time']
+        observed = observed.drop(columns='station_code')
+
+    df = forecasts.merge(observed, on=on, how='inner')
+    df['error'] = df['forecast'] - df['observed']
+    df['abs_error'] = df['error'].abs()
+
+    by = ['place_code', 'lead_hours'] if by_place else ['lead_hours']
+    return df.groupby(by).agg(mae=('abs_error', 'mean'), bias=('error', 'mean'), n=('error', 'count'))
+
+
+def exact_sum(values) -> list:
+    """
+    Exact sum of floats (NaN skipped) kept as a few float components, so sums of chunks can be merged
+    without rounding: math.fsum of all components of all chunks is the correctly rounded sum of all values
+    :param values: array-like of floats
+    :return: list of floats
+    """
+    values = np.asarray(values, dtype='float64')
+    values = values[~np.isnan(values)].tolist()
+    components = []
+    while True:
+        residual = math.fsum(values + [-component for component in components])
+        if residual == 0:
+            return components
+        components.append(residual)
+
+
+def _mean(total: float, count: int) -> float:
+    return total / count if count else np.nan
@@ -0,0 +1,213 @@
+"""
+Local stand-in of api.meteo.lt for offline benchmarks.
+Serves /stations, /places, /stations/{code}/observations/{date} and /places/{code}/forecasts/long-term
+with synthetic data, configurable latency and 429 Too Many Requests injection.
+"""
+import datetime
+import json
+import random
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+CONDITION_CODES = ['clear', 'partly-cloudy', 'cloudy-with-sunny-intervals', 'cloudy', 'light-rain', 'rain',
+                   'light-snow', 'fog']
+
+
+def station_codes(n_stations: int) -> list:
+    return [f"station-{i:03d}" for i in range(n_stations)]
+
+
+def place_codes(n_places: int) -> list:
+    return [f"place-{i:03d}" for i in range(n_places)]
+
+
+def _coordinates(code: str) -> dict:
+    rng = np.random.default_rng(zlib.crc32(code.encode()))
+    return {'latitude': round(float(rng.uniform(53.9, 56.4)), 6), 'longitude': round(float(rng.uniform(21, 26.8)), 6)}
+
+
+def synthetic_series(code: str, time_index: pd.DatetimeIndex) -> dict:
+    """
+    Deterministic hourly weather of the location: seasonal and daily temperature cycle with noise
+    :return: dict of np.array per measurement
+    """
+    rng = np.random.default_rng([zlib.crc32(code.encode()), int(time_index[0].timestamp()) if len(time_index) else 0])
+    n = len(time_index)
+    day_of_year = time_index.dayofyear.to_numpy()
+    hour = time_index.hour.to_numpy()
+
+    temp = (7 - 12 * np.cos(2 * np.pi * (day_of_year - 15) / 365) - 4 * np.cos(2 * np.pi * (hour - 3) / 24)
+            + rng.normal(0, 2, n))
+    precipitation = np.where(rng.random(n) < 0.12, rng.exponential(0.8, n), 0)
+    return {
+        'airTemperature': temp.round(1),
+        'feelsLikeTemperature': (temp - rng.uniform(0, 4, n)).round(1),
+        'windSpeed': rng.gamma(2, 1.5, n).round(1),
+        'windGust': rng.gamma(3, 2, n).round(1),
+        'windDirection': rng.integers(0, 360, n).astype(float),
+        'cloudCover': rng.integers(0, 101, n).astype(float),
+        'seaLevelPressure': rng.normal(1013, 9, n).round(1),
+        'relativeHumidity': rng.uniform(40, 100, n).round(0),
+        'precipitation': precipitation.round(1),
+        'conditionCode': np.array(CONDITION_CODES)[rng.integers(0, len(CONDITION_CODES), n)],
+    }
+
+
+def observations_json(station_code: str, date: str) -> dict:
+    time_index = pd.date_range(date, periods=24, freq='h', tz='UTC')
+    series = synthetic_series(station_code, time_index)
+    observations = [
+        {'observationTimeUtc': time.strftime('%Y-%m-%d %H:%M:%S'),
+         **{name: values[i].item() for name, values in series.items()}}
+        for i, time in enumerate(time_index)
+    ]
+    return {'station': {'code': station_code}, 'observations': observations}
+
+
+def forecast_json(place_code: str, creation_time: pd.Timestamp = None, hours: int = 24 * 7) -> dict:
+    creation_time = creation_time or pd.Timestamp.now(tz='UTC').floor('h')
+    time_index = pd.date_range(creation_time + pd.Timedelta(hours=1), periods=hours, freq='h')
+    series = synthetic_series(place_code, time_index)
+    series['totalPrecipitation'] = series.pop('precipitation')
+    return {
+        'place': {'code': place_code, 'name': place_code.title(), 'administrativeDivision': 'Synthetic',
+                  'country': 'Lietuva', 'countryCode': 'LT', 'coordinates': _coordinates(place_code)},
+        'forecastType': 'long-term',
+        'forecastCreationTimeUtc': creation_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'forecastTimestamps': [
+            {'forecastTimeUtc': time.strftime('%Y-%m-%d %H:%M:%S'),
+             **{name: values[i].item() for name, values in series.items()}}
+            for i, time in enumerate(time_index)
+        ],
+    }
+
+
+def synthetic_historic_frame(station_codes_: list, date_from: str, date_to: str) -> pd.DataFrame:
+    """
+    Synthetic observations shaped like DataMeteo.historic_data, built without the server
+    :return: pd.DataFrame with pd.DatetimeIndex (observationTimeUtc) and station_code column
+    """
+    time_index = pd.date_range(date_from, pd.Timestamp(date_to) + pd.Timedelta(hours=23), freq='h', tz='UTC',
+                               name='observationTimeUtc')
+    frames = []
+    for station_code in station_codes_:
+        df = pd.DataFrame(synthetic_series(station_code, time_index), index=time_index)
+        df['station_code'] = station_code
+        frames.append(df)
+    return pd.concat(frames)
+
+
+class FakeMeteoApi:
+    """
+    Threaded HTTP server imitating api.meteo.lt, use as context manager:
+        with FakeMeteoApi(n_stations=5, latency=0.05) as api:
+            DataMeteo(api_url=api.url, ...)
+    """
+    def __init__(self, n_stations: int = 5, n_places: int = 5, latency: float = 0.0,
+                 error_429_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.n_stations = n_stations
+        self.n_places = n_places
+        self.latency = latency
+        self.error_429_rate = error_429_rate
+        self.retry_after = retry_after
+
+        self.n_requests = 0
+        self.n_errors_429 = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def _route(self, path: str):
+        parts = path.strip('/').split('/')[1:]  # without "v1"
+        if parts == ['stations']:
+            return [{'code': code, 'name': code.title(), 'coordinates': _coordinates(code)}
+                    for code in station_codes(self.n_stations)]
+        if parts == ['places']:
+            return [{'code': code, 'name': code.title(), 'administrativeDivision': 'Synthetic', 'countryCode': 'LT',
+                     'coordinates': _coordinates(code)} for code in place_codes(self.n_places)]
+        if len(parts) == 4 and parts[0] == 'stations' and parts[2] == 'observations':
+            datetime.date.fromisoformat(parts[3])
+            return observations_json(parts[1], parts[3])
+        if len(parts) == 4 and parts[0] == 'places' and parts[2:] == ['forecasts', 'long-term']:
+            return forecast_json(parts[1])
+        return None
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload, headers: dict = None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with api._lock:
+                    api.n_requests += 1
+                    too_many = api._random.random() < api.error_429_rate
+                    if too_many:
+                        api.n_errors_429 += 1
+                if api.latency:
+                    threading.Event().wait(api.latency)
+                if too_many:
+                    self._send(429, {'error': {'code': 429, 'message': 'Too Many Requests'}},
+                               {'Retry-After': str(api.retry_after)})
+                    return
+                try:
+                    payload = api._route(self.path)
+                except ValueError:
+                    payload = None
+                if payload is None:
+                    self._send(404, {'error': {'code': 404, 'message': 'Not Found'}})
+                    return
+
+                # Forecasts support conditional requests, ETag changes with the forecast creation time
+                headers = {}
+                if isinstance(payload, dict) and 'forecastCreationTimeUtc' in payload:
+                    headers['ETag'] = f'"{payload["place"]["code"]}-{payload["forecastCreationTimeUtc"]}"'
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        self.send_response(304)
+                        self.send_header('ETag', headers['ETag'])
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                self._send(200, payload, headers)
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,113 @@
+"""
+Offline benchmarks of data retrieval and analysis against the local api.meteo.lt stand-in.
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --days 60 --stations 3 --latency 0.05 --error-429-rate 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+
+import pandas as pd
+
+import http_client
+import instrumentation
+import models
+import utils
+from benchmarks.fake_api import FakeMeteoApi, station_codes, place_codes, synthetic_historic_frame
+
+
+def measure(name: str, func, api: FakeMeteoApi = None) -> dict:
+    """
+    Runs func once, measuring wall time, peak traced memory and requests made to the stand-in
+    :return: dict with the results
+    """
+    n_requests_before = api.n_requests if api else 0
+    n_429_before = api.n_errors_429 if api else 0
+
+    tracemalloc.start()
+    time_start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    wall_time = time.perf_counter() - time_start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n_requests = (api.n_requests - n_requests_before) if api else 0
+    return {
+        'benchmark': name,
+        'wall_time_s': round(wall_time, 4),
+        'peak_memory_mb': round(peak_memory / 2 ** 20, 2),
+        'requests': n_requests,
+        'requests_per_s': round(n_requests / wall_time, 2) if n_requests else None,
+        'errors_429': (api.n_errors_429 - n_429_before) if api else 0,
+    }
+
+
+def run(args) -> list:
+    results = []
+
+    # Rate limit of the benchmark bucket, the stand-in has no quota of its own
+    http_client.DEFAULT_BUCKET = http_client.TokenBucket(max_requests_per_minute=args.rate)
+
+    date_to = '2024-12-31'
+    date_from = str((pd.Timestamp(date_to) - pd.Timedelta(days=args.days - 1)).date())
+
+    with FakeMeteoApi(n_stations=args.stations, n_places=args.stations, latency=args.latency,
+                      error_429_rate=args.error_429_rate, retry_after=args.retry_after) as api:
+        station_code = station_codes(args.stations)[0]
+        place_code = place_codes(args.stations)[0]
+        weather_data = models.DataMeteo(api_url=api.url, station_code=station_code, place_code=place_code,
+                                        cache_dir=None)
+
+        results.append(measure('get_historic_data', lambda: weather_data.get_historic_data(
+            date_from=date_from, date_to=date_to, max_workers=args.workers), api))
+        results.append(measure('get_forecast_data', weather_data.get_forecast_data, api))
+
+        batch = models.DataMeteoBatch(api_url=api.url, station_codes=station_codes(args.stations),
+                                      place_codes=place_codes(args.stations), cache_dir=None)
+        results.append(measure('DataMeteoBatch.get_historic_data', lambda: batch.get_historic_data(
+            date_from=date_from, date_to=date_to, max_workers=args.workers), api))
+
+        df_forecast = weather_data.forecast_data
+
+    # Analysis runs on synthetic multi-year data generated in memory
+    df_hist = synthetic_historic_frame([station_codes(1)[0]], f"{2025 - args.years}-01-01", '2024-12-31')
+    history_analysis = models.HistAnalysis(df_hist=df_hist, df_forecast=df_forecast)
+
+    results.append(measure('HistAnalysis.processing', history_analysis.processing))
+    results.append(measure('HistAnalysis.get_mean_metrics', history_analysis.get_mean_metrics))
+    results.append(measure('interpolate_temp', lambda: utils.interpolate_temp(df_hist['airTemperature'])))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=30, help='days of observations to fetch per station')
+    parser.add_argument('--stations', type=int, default=3, help='stations (and places) served by the stand-in')
+    parser.add_argument('--years', type=int, default=3, help='years of synthetic data for analysis benchmarks')
+    parser.add_argument('--latency', type=float, default=0.05, help='response latency of the stand-in, seconds')
+    parser.add_argument('--error-429-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of injected 429, seconds')
+    parser.add_argument('--rate', type=int, default=6000, help='requests per minute allowed by the token bucket')
+    parser.add_argument('--workers', type=int, default=http_client.MAX_WORKERS, help='requests kept in flight')
+    parser.add_argument('--json', help='path to save the results as json')
+    parser.add_argument('--instrumentation', help='path to save pipeline instrumentation (json, .prom for Prometheus)')
+    args = parser.parse_args()
+
+    results = run(args)
+    print(pd.DataFrame(results).set_index('benchmark').to_string())
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.instrumentation:
+        if args.instrumentation.endswith('.prom'):
+            instrumentation.METRICS.to_prometheus(args.instrumentation)
+        else:
+            instrumentation.METRICS.to_json(args.instrumentation)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Record / replay of API responses. Responses are kept in a local store of gzip compressed files
+(one per url), so runs can be repeated offline at disk speed against captured API data.
+Enabled for the whole process with environment variables, e.g.:
+    METEO_CASSETTE_MODE=record python main.py
+    METEO_CASSETTE_MODE=replay streamlit run streamlit_app.py
+or in code with http_client.use_cassettes()
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from instrumentation import METRICS
+
+MODES = ('record', 'replay', 'once')
+
+
+class CassetteNotFound(LookupError):
+    """
+    Response of the url was not recorded and the store is in replay mode
+    """
+
+
+class CassetteStore:
+    """
+    Modes:
+        record - every request goes to the network, successful responses are (re)recorded
+        replay - responses are served only from the store, network is never used
+        once - recorded responses are replayed, missing ones are requested and recorded
+    """
+    def __init__(self, cassette_dir: str = 'outs/cassettes', mode: str = 'once'):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        self.cassette_dir = cassette_dir
+        self.mode = mode
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cassette_dir, key[:2], f"{key}.json.gz")
+
+    @property
+    def records(self) -> bool:
+        return self.mode in ('record', 'once')
+
+    def load(self, url: str):
+        """
+        :param url: request url
+        :return: recorded requests.Response, None if the response has to be requested (and recorded)
+        """
+        if self.mode == 'record':
+            return None
+
+        path = self._path(url)
+        if not os.path.exists(path):
+            METRICS.inc('cache_misses', cache='cassettes')
+            if self.mode == 'replay':
+                raise CassetteNotFound(f"Response is not recorded in {self.cassette_dir}: {url}")
+            return None
+
+        METRICS.inc('cache_hits', cache='cassettes')
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            record = json.load(f)
+
+        response = requests.Response()
+        response.url = record['url']
+        response.status_code = record['status']
+        response.reason = record['reason']
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.encoding = record['encoding']
+        response._content = (record['body'].encode('utf-8') if 'body' in record
+                             else base64.b64decode(record['body_base64']))
+        return response
+
+    def save(self, url: str, response: requests.Response):
+        """
+        Records the response of the url, only successful responses are recorded
+        """
+        if not self.records or response.status_code != 200:
+            return
+
+        record = {
+            'url': url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict(response.headers),
+            'encoding': response.encoding,
+            'recorded_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        try:
+            record['body'] = response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            record['body_base64'] = base64.b64encode(response.content).decode('ascii')
+
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        path_tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(path_tmp, 'wt', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(path_tmp, path)
+
+
+def from_environment():
+    """
+    :return: CassetteStore configured by METEO_CASSETTE_MODE and METEO_CASSETTE_DIR, None if mode is not set
+    """
+    mode = os.environ.get('METEO_CASSETTE_MODE')
+    if not mode:
+        return None
+    return CassetteStore(cassette_dir=os.environ.get('METEO_CASSETTE_DIR', 'outs/cassettes'), mode=mode)
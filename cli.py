@@ -0,0 +1,279 @@
+"""
+Command line interface of the weather data pipeline. Each subcommand imports only the modules it needs
+(pandas, requests, plotly are not loaded to parse arguments) and location codes are checked against
+the API only with --validate, so scheduled jobs start fast and run only the stages they need.
+    python cli.py fetch --stations vilniaus-ams kauno-ams --places vilnius --date-from 2024-01-01 --output outs/archive
+    python cli.py analyze --input outs/archive --date-from 2024-06-01 --date-to 2024-08-31
+    python cli.py compare --station vilniaus-ams --place vilnius --input outs/weather_data.vilnius.historic.365.csv
+    python cli.py interpolate --input outs/weather_data.vilnius.historic.365.csv --freq 5min --output outs/interpolated.csv
+    python cli.py serve
+Without subcommand (python main.py) the report of all the tasks is printed.
+"""
+import argparse
+import datetime
+import os
+import sys
+
+API_URL = 'https://api.meteo.lt/v1/'
+STATION_CODE = 'vilniaus-ams'
+PLACE_CODE = 'vilnius'
+PATH_HISTORIC_DATA = 'outs/weather_data.vilnius.historic.365.csv'
+
+
+def fetch(args):
+    """
+    Downloads observations of the stations (and forecasts of the places) and saves them
+    """
+    import models
+
+    batch = models.DataMeteoBatch(api_url=args.api_url, station_codes=args.stations, place_codes=args.places,
+                                  cache_dir=args.cache_dir, validate=args.validate)
+    if batch.station_codes:
+        batch.get_historic_data(date_from=args.date_from, date_to=args.date_to, max_workers=args.workers)
+        print(f"Observations: {len(batch.historic_data)} rows of {len(batch.station_codes)} stations")
+        if args.output:
+            _save_frame(batch.historic_data.reset_index(level=0), args.output, 'station_code')
+
+    if batch.place_codes:
+        batch.get_forecast_data(max_workers=args.workers)
+        print(f"Forecasts: {len(batch.forecast_data)} rows of {len(batch.place_codes)} places")
+        if args.forecast_output:
+            _save_frame(batch.forecast_data.reset_index(level=0), args.forecast_output, 'place_code')
+
+
+def analyze(args):
+    """
+    Mean metrics of each station. Parquet files and archives are streamed in chunks (see models.analyze_archive)
+    """
+    import pandas as pd
+
+    import models
+
+    if _is_csv(args.input):
+        df_hist = _read_historic(args.input, args.stations, args.date_from, args.date_to)
+        metrics = {
+            station_code: models.HistAnalysis(df_hist=df_station.copy()).processing()
+            .get_mean_metrics(verbose=False).get_metrics_dict()
+            for station_code, df_station in df_hist.groupby('station_code', sort=False, observed=True)
+        }
+        df_metrics = pd.DataFrame.from_dict(metrics, orient='index').rename_axis('station_code')
+    else:
+        df_metrics = models.analyze_archive(args.input, date_from=args.date_from, date_to=args.date_to,
+                                            station_codes=args.stations, chunk_rows=args.chunk_rows)
+
+    print(df_metrics.to_string())
+    if args.output:
+        _save_frame(df_metrics, args.output)
+
+
+def compare(args):
+    """
+    Observations of the previous week next to the current forecast of the place
+    """
+    import models
+
+    weather_data = models.DataMeteo(api_url=args.api_url, station_code=args.station, place_code=args.place,
+                                    cache_dir=args.cache_dir, validate=args.validate)
+    weather_data.get_forecast_data()
+    if args.input:
+        df_hist = _read_historic(args.input, [args.station], None, None)
+    else:
+        date_to = datetime.date.today()
+        weather_data.get_historic_data(date_from=str(date_to - datetime.timedelta(days=14)), date_to=str(date_to))
+        df_hist = weather_data.historic_data
+
+    history_analysis = models.HistAnalysis(df_hist=df_hist, df_forecast=weather_data.forecast_data).processing()
+    history_analysis.compare_hist_n_forecast(show_figure=args.show)
+    print(history_analysis.df_hist_n_forecast.groupby('type')['airTemperature'].describe().to_string())
+    if args.output:
+        history_analysis.fig_hist_n_forecast.write_html(args.output)
+
+
+def interpolate(args):
+    """
+    Resamples measurements of each station to a regular time step by linear interpolation
+    """
+    import utils
+
+    df_hist = _read_historic(args.input, args.stations, args.date_from, args.date_to)
+    df_hist = df_hist.set_index('station_code', append=True).swaplevel()
+    df_interpolated = utils.resample_interpolate(df_hist, freq=args.freq, columns=args.columns)
+
+    print(df_interpolated.head(50).to_string())
+    if args.output:
+        _save_frame(df_interpolated.reset_index(level=0), args.output, 'station_code')
+
+
+def serve(args):
+    """
+    Starts the Streamlit app, record / replay settings are passed on through environment variables
+    """
+    import subprocess
+
+    env = dict(os.environ)
+    if args.cassettes:
+        env.update(METEO_CASSETTE_MODE=args.cassettes, METEO_CASSETTE_DIR=args.cassette_dir)
+    path_app = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app.py')
+    return subprocess.call([sys.executable, '-m', 'streamlit', 'run', path_app, '--server.port', str(args.port)],
+                           env=env)
+
+
+def report(args):
+    """
+    Report of all the tasks (former main.py script): metrics of the last year, comparison with the forecast
+    and interpolated temperature
+    """
+    import models
+    import utils
+
+    date_today = datetime.date.today().strftime('%Y-%m-%d')
+    date_year_back = (datetime.date.today() - datetime.timedelta(days=365)).strftime('%Y-%m-%d')
+
+    weather_data = models.DataMeteo(api_url=args.api_url, station_code=STATION_CODE, place_code=PLACE_CODE,
+                                    cache_dir=args.cache_dir, validate=args.validate)
+    weather_data = weather_data.get_forecast_data()
+    weather_data = weather_data.get_historic_data(date_from=date_year_back, date_to=date_today,
+                                                  path_df_from_csv=PATH_HISTORIC_DATA)
+
+    history_analysis = models.HistAnalysis(df_hist=weather_data.historic_data, df_forecast=weather_data.forecast_data)
+    history_analysis = history_analysis.processing()
+    history_analysis.get_mean_metrics()
+    history_analysis.compare_hist_n_forecast(show_figure=True)
+
+    series_interpolated = utils.interpolate_temp(my_series=history_analysis.df_hist_n_forecast['airTemperature'])
+    print(series_interpolated.head(50).to_string())
+
+
+def _is_csv(path: str) -> bool:
+    return path.endswith('.csv')
+
+
+def _read_historic(path: str, station_codes: list = None, date_from=None, date_to=None):
+    """
+    Reads observations saved by DataMeteo.save_historic_data or fetch (csv, parquet file or archive)
+    :return: pd.DataFrame with pd.DatetimeIndex and station_code column
+    """
+    import pandas as pd
+
+    import storage
+    import utils
+
+    if not _is_csv(path):
+        import pyarrow.dataset as ds
+
+        filters = ds.field('station_code').isin(station_codes) if station_codes else None
+        return storage.read_frame(path, date_from=date_from, date_to=date_to, filters=filters)
+
+    df = pd.read_csv(path)
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('observationTimeUtc'), utc=True), name='observationTimeUtc')
+    if station_codes:
+        df = df.loc[df['station_code'].isin(station_codes)]
+    time_to = pd.Timestamp(date_to) + pd.Timedelta(days=1) if date_to is not None else None
+    return utils.slice_time(df, date_from, time_to)
+
+
+def _save_frame(df, path: str, partition_column: str = None):
+    """
+    Saves frame as csv, parquet file, or partitioned parquet dataset if path has no extension.
+    Parquet outputs are merged with the data saved before (see storage.upsert_frame), csv is overwritten
+    """
+    import storage
+
+    if _is_csv(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        df.to_csv(path)
+    elif path.endswith('.parquet') or partition_column is None:
+        storage.upsert_frame(df, path, key_columns=[partition_column] if partition_column else None)
+    else:
+        storage.upsert_frame(df, path, partition_cols=[partition_column])
+    print(f"Saved to {path}")
+
+
+def _date(value: str) -> str:
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    date_today = datetime.date.today()
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--api-url', default=API_URL, help='API root url')
+    common.add_argument('--cache-dir', default='outs/cache', help='local cache of downloaded data, "" disables it')
+    common.add_argument('--validate', action='store_true', help='check location codes against the API catalog')
+    common.add_argument('--cassettes', choices=['record', 'replay', 'once'],
+                        help='record / replay API responses (see cassettes.py)')
+    common.add_argument('--cassette-dir', default='outs/cassettes', help='directory of recorded responses')
+    common.add_argument('--instrumentation', help='path to save pipeline instrumentation (json, .prom for Prometheus)')
+
+    dates = argparse.ArgumentParser(add_help=False)
+    dates.add_argument('--date-from', type=_date, default=str(date_today - datetime.timedelta(days=365)),
+                       help='first date (inclusive, YYYY-MM-DD), a year back by default')
+    dates.add_argument('--date-to', type=_date, default=str(date_today),
+                       help='last date (inclusive, YYYY-MM-DD), today by default')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     parents=[common])
+    parser.set_defaults(func=report)
+    subparsers = parser.add_subparsers(title='subcommands')
+
+    parser_fetch = subparsers.add_parser('fetch', parents=[common, dates], help=fetch.__doc__.strip())
+    parser_fetch.add_argument('--stations', nargs='*', default=[], help='station codes of observations')
+    parser_fetch.add_argument('--places', nargs='*', default=[], help='place codes of forecasts')
+    parser_fetch.add_argument('--output', help='observations file (.csv, .parquet) or archive directory')
+    parser_fetch.add_argument('--forecast-output', help='forecasts file (.csv, .parquet) or archive directory')
+    parser_fetch.add_argument('--workers', type=int, default=8, help='requests kept in flight')
+    parser_fetch.set_defaults(func=fetch)
+
+    parser_analyze = subparsers.add_parser('analyze', parents=[common, dates], help=analyze.__doc__.strip())
+    parser_analyze.add_argument('--input', required=True, help='observations file (.csv, .parquet) or archive')
+    parser_analyze.add_argument('--stations', nargs='*', help='stations to analyse, all by default')
+    parser_analyze.add_argument('--chunk-rows', type=int, default=24 * 366, help='observations in memory at once')
+    parser_analyze.add_argument('--output', help='path to save the metrics (.csv, .parquet)')
+    parser_analyze.set_defaults(func=analyze)
+
+    parser_compare = subparsers.add_parser('compare', parents=[common], help=compare.__doc__.strip())
+    parser_compare.add_argument('--station', default=STATION_CODE, help='station code of observations')
+    parser_compare.add_argument('--place', default=PLACE_CODE, help='place code of the forecast')
+    parser_compare.add_argument('--input', help='observations file or archive, fetched from the API by default')
+    parser_compare.add_argument('--show', action='store_true', help='open the figure in the browser')
+    parser_compare.add_argument('--output', help='path to save the figure (.html)')
+    parser_compare.set_defaults(func=compare)
+
+    parser_interpolate = subparsers.add_parser('interpolate', parents=[common, dates],
+                                               help=interpolate.__doc__.strip())
+    parser_interpolate.add_argument('--input', required=True, help='observations file (.csv, .parquet) or archive')
+    parser_interpolate.add_argument('--stations', nargs='*', help='stations to interpolate, all by default')
+    parser_interpolate.add_argument('--columns', nargs='*', default=['airTemperature'], help='measurements')
+    parser_interpolate.add_argument('--freq', default='5min', help='time step, e.g. 5min, 15min')
+    parser_interpolate.add_argument('--output', help='path to save the result (.csv, .parquet or archive)')
+    parser_interpolate.set_defaults(func=interpolate)
+
+    parser_serve = subparsers.add_parser('serve', parents=[common], help=serve.__doc__.strip())
+    parser_serve.add_argument('--port', type=int, default=8501, help='port of the Streamlit server')
+    parser_serve.set_defaults(func=serve)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = get_parser().parse_args(argv)
+    args.cache_dir = args.cache_dir or None
+
+    if args.cassettes and args.func is not serve:
+        import http_client
+
+        http_client.use_cassettes(args.cassette_dir, args.cassettes)
+
+    exit_code = args.func(args)
+
+    if args.instrumentation:
+        import instrumentation
+
+        if args.instrumentation.endswith('.prom'):
+            instrumentation.METRICS.to_prometheus(args.instrumentation)
+        else:
+            instrumentation.METRICS.to_json(args.instrumentation)
+    return exit_code or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
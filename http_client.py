@@ -0,0 +1,346 @@
+import email.utils
+import os
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cassettes
+from instrumentation import METRICS
+
+try:
+    import fcntl
+except ImportError:  # Windows, quota is shared only within the process
+    fcntl = None
+
+MAX_REQUESTS_PER_MINUTE = 180  # api.meteo.lt constraint
+MAX_WORKERS = 8
+MAX_ERROR_PAYLOAD_BYTES = 1024  # error bodies are small json objects
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of requests.
+    With capacity=1 requests are spaced evenly, so any 60 s window holds at most max_requests_per_minute requests,
+    no matter how long each response takes.
+    """
+    def __init__(self, max_requests_per_minute: int = MAX_REQUESTS_PER_MINUTE, capacity: int = 1):
+        self.rate = max_requests_per_minute / 60  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """
+        Stops handing out tokens for given amount of seconds (e.g. after 429 Too Many Requests)
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.blocked_until
+
+
+class SharedTokenBucket:
+    """
+    Token bucket shared by all processes of the machine (ingestion workers, streamlit app, main.py).
+    Schedule is kept in a small state file guarded by an exclusive file lock: each request reserves
+    the next free slot, slots are spaced by 60 / max_requests_per_minute seconds, so processes together
+    saturate the API constraint without going over it.
+    """
+    _state = struct.Struct('dd')  # next free slot, blocked until (unix time)
+
+    def __init__(self, max_requests_per_minute: int = MAX_REQUESTS_PER_MINUTE,
+                 path: str = os.path.join(tempfile.gettempdir(), 'api.meteo.lt.quota')):
+        self.interval = 60 / max_requests_per_minute
+        self.path = path
+
+    def _update(self, update):
+        """
+        Reads the state under the lock, writes back state returned by update(next_free, blocked_until, now)
+        :return: value returned by update
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, self._state.size, 0)
+            next_free, blocked_until = self._state.unpack(raw) if len(raw) == self._state.size else (0.0, 0.0)
+            next_free, blocked_until, result = update(next_free, blocked_until, time.time())
+            os.pwrite(fd, self._state.pack(next_free, blocked_until), 0)
+            return result
+        finally:
+            os.close(fd)  # releases the lock as well
+
+    def acquire(self):
+        """
+        Blocks until the reserved slot comes
+        :return: seconds spent waiting
+        """
+        def reserve(next_free, blocked_until, now):
+            slot = max(next_free, blocked_until, now)
+            return slot + self.interval, blocked_until, slot
+
+        waited = 0.0
+        while True:
+            slot = self._update(reserve)
+            wait = slot - time.time()
+            if wait > 0:
+                time.sleep(wait)
+                waited += wait
+            # Other process could have been paused by 429 while we were waiting for the slot
+            blocked_until = self._update(lambda next_free, blocked, now: (next_free, blocked, blocked))
+            if blocked_until <= slot:
+                return waited
+
+    def pause(self, seconds: float):
+        """
+        Stops handing out slots in all processes for given amount of seconds (e.g. after 429 Too Many Requests)
+        """
+        self._update(lambda next_free, blocked_until, now: (next_free, max(blocked_until, now + seconds), None))
+
+
+DEFAULT_BUCKET = SharedTokenBucket() if fcntl is not None else TokenBucket()
+
+# Record / replay store of responses (see cassettes.py), set by environment variables or use_cassettes()
+CASSETTES = cassettes.from_environment()
+
+
+def use_cassettes(cassette_dir: str = 'outs/cassettes', mode: str = 'once'):
+    """
+    Routes all requests of the process through the record / replay store
+    :param cassette_dir: directory of the store, None switches record / replay off
+    :param mode: 'record', 'replay' or 'once' (see cassettes.CassetteStore)
+    :return: cassettes.CassetteStore or None
+    """
+    global CASSETTES
+    CASSETTES = cassettes.CassetteStore(cassette_dir, mode) if cassette_dir else None
+    return CASSETTES
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """
+    Returns shared keep-alive session, so connections to the API are reused between requests.
+    Connection pool is sized to the largest pool_size requested so far
+    :param pool_size: number of connections kept per host, e.g. max_workers of the caller
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        if pool_size > _session_pool_size:
+            # Previous adapter is not closed, requests in flight finish on its connections
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session_pool_size = pool_size
+        return _session
+
+
+def is_too_many_requests(response: requests.Response) -> bool:
+    """
+    API signals rate limit violation either by status code or by the error body
+    """
+    if response.status_code == 429:
+        return True
+    # Only small bodies mentioning 429 can be the error payload, data bodies are decoded once by the caller
+    if len(response.content) > MAX_ERROR_PAYLOAD_BYTES or b'429' not in response.content:
+        return False
+    try:
+        payload = response.json()
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get('error', {}).get('code') == 429
+
+
+def retry_after_seconds(response: requests.Response, attempt: int, backoff_base: float = 5, backoff_max: float = 60):
+    """
+    Reads Retry-After header (seconds or HTTP date). Falls back to exponential backoff if header is missing.
+    :param response: 429 or 5xx response, None if request failed without response (connection error, timeout)
+    :param attempt: number of the retry, starting from 0
+    :return: float, seconds to wait
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return max(retry_at.timestamp() - time.time(), 0)
+            except (TypeError, ValueError):
+                pass
+    return min(backoff_base * 2 ** attempt, backoff_max)
+
+
+def get(url: str, session: requests.Session = None, bucket=None, max_retries: int = 5, timeout: float = 30,
+        headers: dict = None) -> requests.Response:
+    """
+    GET request limited by the token bucket. On 429 the whole bucket is paused (so other workers wait as well)
+    and the request is retried. Server errors and network errors are retried with the same backoff.
+    If record / replay is on (see use_cassettes), recorded responses are returned without network.
+    :param url: request url
+    :param session: requests.Session, shared session by default
+    :param bucket: TokenBucket or SharedTokenBucket, DEFAULT_BUCKET by default
+    :param max_retries: how many times to retry after 429, server errors (5xx), connection errors and timeouts
+    :param timeout: request timeout in seconds
+    :param headers: additional request headers
+    :return: requests.Response
+    """
+    store = CASSETTES
+    if store is not None:
+        response = store.load(url)
+        if response is not None:
+            return response  # replayed without network and rate limiting
+        if headers:
+            # Full response is recorded, so conditional headers are not sent
+            headers = {name: value for name, value in headers.items()
+                       if name not in ('If-None-Match', 'If-Modified-Since')}
+
+    session = session or get_session()
+    bucket = bucket or DEFAULT_BUCKET
+
+    for attempt in range(max_retries + 1):
+        METRICS.inc('throttle_sleep_seconds', bucket.acquire())
+
+        time_start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout, headers=headers)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            # Transient network error, only this request backs off
+            METRICS.inc('http_errors', kind=type(error).__name__)
+            if attempt == max_retries:
+                raise
+            wait = retry_after_seconds(None, attempt)
+            print(f"{type(error).__name__}, sleeping {wait:.1f} sec before retrying {url}...")
+            time.sleep(wait)
+            continue
+        METRICS.observe('http_request_duration_seconds', time.perf_counter() - time_start)
+        METRICS.inc('http_requests', status=response.status_code)
+        METRICS.inc('http_response_bytes', len(response.content))
+
+        if is_too_many_requests(response):
+            METRICS.inc('http_errors_429')
+            wait = retry_after_seconds(response, attempt)
+            print(f"Too many requests, sleeping {wait:.1f} sec before retrying {url}...")
+            bucket.pause(wait)
+        elif response.status_code >= 500:
+            METRICS.inc('http_errors', kind=str(response.status_code))
+            if attempt == max_retries:
+                break
+            wait = retry_after_seconds(response, attempt)
+            print(f"Server error {response.status_code}, sleeping {wait:.1f} sec before retrying {url}...")
+            time.sleep(wait)
+        else:
+            if store is not None:
+                store.save(url, response)
+            return response
+
+    if response.status_code >= 500:
+        raise requests.HTTPError(f"{response.status_code} Server Error: gave up after {max_retries} retries: {url}",
+                                 response=response)
+    raise requests.HTTPError(f"429 Too Many Requests: gave up after {max_retries} retries: {url}", response=response)
+
+
+def get_json(url: str, **kwargs):
+    """
+    GET request limited by the token bucket, see get()
+    :return: decoded json
+    """
+    response = get(url, **kwargs)
+    with METRICS.stage('json_decode'):
+        return response.json()
+
+
+def get_json_conditional(url: str, validators: dict = None, **kwargs):
+    """
+    Conditional GET: sends ETag / Last-Modified of the previous response, so unchanged resources are not downloaded
+    :param url: request url
+    :param validators: {'etag': ..., 'last_modified': ...} of the previous response
+    :return: (decoded json or None if not modified, validators of the response)
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    response = get(url, headers=headers, **kwargs)
+    if response.status_code == 304:
+        return None, validators
+    with METRICS.stage('json_decode'):
+        data = response.json()
+    return data, {'etag': response.headers.get('ETag'),
+                  'last_modified': response.headers.get('Last-Modified')}
+
+
+def get_json_many(urls: list, max_workers: int = MAX_WORKERS, session: requests.Session = None,
+                  bucket=None, progress: bool = True) -> list:
+    """
+    Fetches urls concurrently, keeping several requests in flight while the bucket keeps the API rate constraint
+    :param urls: list of request urls
+    :param max_workers: number of requests in flight
+    :return: list of decoded json in the same order as urls
+    """
+    session = session or get_session(pool_size=max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda url: get_json(url, session=session, bucket=bucket), urls)
+        if progress:
+            from tqdm import tqdm
+
+            results = tqdm(results, total=len(urls))
+        return list(results)
+
+
+def iter_json_completed(urls: list, max_workers: int = MAX_WORKERS, session: requests.Session = None,
+                        bucket=None, progress: bool = True):
+    """
+    Fetches urls concurrently like get_json_many, but yields each result as soon as it arrives,
+    so results can be stored before the whole batch is done. Failed requests do not stop the others.
+    :param urls: list of request urls
+    :param max_workers: number of requests in flight
+    :return: generator of (position of the url, decoded json or None, exception or None) in completion order
+    """
+    session = session or get_session(pool_size=max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(get_json, url, session=session, bucket=bucket): i for i, url in enumerate(urls)}
+        completed = as_completed(futures)
+        if progress:
+            from tqdm import tqdm
+
+            completed = tqdm(completed, total=len(urls))
+        for future in completed:
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
@@ -0,0 +1,151 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]  # seconds
+
+
+class Metrics:
+    """
+    Process-wide registry of pipeline measurements: per-stage wall/CPU time, counters and histograms.
+    Exported as json or Prometheus text format.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}  # stage -> {'calls', 'wall_seconds', 'cpu_seconds'}
+            self.counters = {}  # (name, labels) -> value
+            self.histograms = {}  # name -> {'buckets', 'counts', 'sum', 'count'}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Measures wall and CPU time of the block. CPU time is of the whole process, so work of thread pools
+        started in the block is included (and so is work of other threads running at the same time)
+        """
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            with self._lock:
+                stage = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+                stage['calls'] += 1
+                stage['wall_seconds'] += wall
+                stage['cpu_seconds'] += cpu
+
+    def timed(self, name: str):
+        """
+        Decorator measuring each call of the function as the stage
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: list = LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.setdefault(
+                name, {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0})
+            histogram['counts'][int(np.searchsorted(histogram['buckets'], value, side='left'))] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def cache_hit_ratios(self) -> dict:
+        """
+        :return: {cache name: hits / (hits + misses)}
+        """
+        totals = {}
+        for (name, labels), value in self.counters.items():
+            if name in ('cache_hits', 'cache_misses'):
+                cache = dict(labels).get('cache')
+                totals.setdefault(cache, {'cache_hits': 0, 'cache_misses': 0})[name] += value
+        return {cache: total['cache_hits'] / (total['cache_hits'] + total['cache_misses'])
+                for cache, total in totals.items() if total['cache_hits'] + total['cache_misses']}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'histograms': {name: dict(histogram) for name, histogram in self.histograms.items()},
+                'cache_hit_ratios': self.cache_hit_ratios(),
+            }
+
+    def to_json(self, path: str = None) -> str:
+        """
+        :param path: file to write, only returns the text if None
+        :return: json text
+        """
+        text = json.dumps(self.to_dict(), indent=2)
+        if path:
+            _write_atomic(path, text)
+        return text
+
+    def to_prometheus(self, path: str = None, prefix: str = 'meteo') -> str:
+        """
+        Prometheus text exposition format, e.g. for node_exporter textfile collector
+        :param path: file to write, only returns the text if None
+        :return: text
+        """
+        lines = []
+        with self._lock:
+            for metric, field in [('stage_calls_total', 'calls'), ('stage_wall_seconds_total', 'wall_seconds'),
+                                  ('stage_cpu_seconds_total', 'cpu_seconds')]:
+                lines.append(f"# TYPE {prefix}_{metric} counter")
+                lines += [f'{prefix}_{metric}{{stage="{name}"}} {stage[field]}' for name, stage in self.stages.items()]
+
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (counter_name, labels), value in self.counters.items():
+                    if counter_name == name:
+                        lines.append(f"{prefix}_{name}_total{_labels(dict(labels))} {value}")
+
+            for name, histogram in self.histograms.items():
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                cumulative = np.cumsum(histogram['counts'])
+                for le, count in zip([*histogram['buckets'], '+Inf'], cumulative):
+                    lines.append(f'{prefix}_{name}_bucket{{le="{le}"}} {count}')
+                lines.append(f"{prefix}_{name}_sum {histogram['sum']}")
+                lines.append(f"{prefix}_{name}_count {histogram['count']}")
+
+        text = "\n".join(lines) + "\n"
+        if path:
+            _write_atomic(path, text)
+        return text
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def _write_atomic(path: str, text: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    path_tmp = f"{path}.{os.getpid()}.tmp"
+    with open(path_tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path_tmp, path)
+
+
+METRICS = Metrics()
+stage = METRICS.stage
+timed = METRICS.timed
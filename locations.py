@@ -0,0 +1,127 @@
+import datetime
+import functools
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import http_client
+from instrumentation import METRICS
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class LocationCatalog:
+    """
+    Catalog of observation stations and forecast places.
+    Lists are downloaded once and kept on disk for ttl, lookups by code are O(1).
+    """
+    def __init__(self,
+                 api_url: str = 'https://api.meteo.lt/v1/',
+                 cache_path: str = 'outs/cache/locations.json',
+                 ttl: datetime.timedelta = datetime.timedelta(days=1)):
+        self.api_url = api_url
+        self.cache_path = cache_path
+        self.ttl = ttl
+
+        self.stations = None  # pd.DataFrame indexed by station code
+        self.places = None  # pd.DataFrame indexed by place code
+        self.loaded_at = None  # time.time() of the last load
+
+    def _is_cache_fresh(self) -> bool:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        age = time.time() - os.path.getmtime(self.cache_path)
+        return age < self.ttl.total_seconds()
+
+    def load(self, refresh: bool = False):
+        """
+        Loads the catalog from disk, downloads it from the API if the file is missing, expired or refresh=True
+        """
+        if not refresh and self._is_cache_fresh():
+            METRICS.inc('cache_hits', cache='locations')
+            with open(self.cache_path, encoding='utf-8') as f:
+                raw = json.load(f)
+        else:
+            METRICS.inc('cache_misses', cache='locations')
+            raw = {
+                'station': http_client.get_json(f"{self.api_url}stations"),
+                'place': http_client.get_json(f"{self.api_url}places"),
+            }
+            if self.cache_path:
+                os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+                path_tmp = f"{self.cache_path}.{os.getpid()}.tmp"
+                with open(path_tmp, 'w', encoding='utf-8') as f:
+                    json.dump(raw, f)
+                os.replace(path_tmp, self.cache_path)
+
+        self.stations = self._to_frame(raw['station'])
+        self.places = self._to_frame(raw['place'])
+        self.loaded_at = time.time()
+        return self
+
+    @staticmethod
+    def _to_frame(locations: list) -> pd.DataFrame:
+        df = pd.json_normalize(locations)
+        df = df.rename(columns={'coordinates.latitude': 'latitude', 'coordinates.longitude': 'longitude'})
+        return df.set_index('code', drop=False)
+
+    def _locations(self, location_type: str) -> pd.DataFrame:
+        # Catalog kept in memory of a long-running process (e.g. Streamlit server) expires like the file
+        if self.stations is None or time.time() - self.loaded_at >= self.ttl.total_seconds():
+            self.load()
+        return {'station': self.stations, 'place': self.places}[location_type]
+
+    def codes(self, location_type: str) -> list:
+        """
+        :param location_type: 'station' or 'place'
+        :return: list of valid location codes
+        """
+        return self._locations(location_type).index.tolist()
+
+    def is_valid(self, location_code: str, location_type: str) -> bool:
+        """
+        :param location_code: location identifier
+        :param location_type: 'station' or 'place'
+        """
+        return location_code in self._locations(location_type).index
+
+    def nearest_stations(self, place_codes: list = None) -> pd.DataFrame:
+        """
+        Pairs forecast places with their closest observation station (great-circle distance),
+        computed for all places at once
+        :param place_codes: list of place codes, all places by default
+        :return: pd.DataFrame indexed by place_code with station_code and distance_km
+        """
+        places = self._locations('place')
+        stations = self._locations('station')
+        if place_codes is not None:
+            places = places.loc[place_codes]
+
+        lat_p = np.radians(places['latitude'].to_numpy())[:, None]
+        lon_p = np.radians(places['longitude'].to_numpy())[:, None]
+        lat_s = np.radians(stations['latitude'].to_numpy())[None, :]
+        lon_s = np.radians(stations['longitude'].to_numpy())[None, :]
+
+        # Haversine distance matrix places x stations
+        a = (np.sin((lat_s - lat_p) / 2) ** 2
+             + np.cos(lat_p) * np.cos(lat_s) * np.sin((lon_s - lon_p) / 2) ** 2)
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        nearest = distances.argmin(axis=1)
+
+        return pd.DataFrame({
+            'station_code': stations.index.to_numpy()[nearest],
+            'distance_km': distances[np.arange(len(places)), nearest],
+        }, index=pd.Index(places.index, name='place_code'))
+
+
+@functools.lru_cache(maxsize=None)
+def get_catalog(api_url: str = 'https://api.meteo.lt/v1/') -> LocationCatalog:
+    """
+    :return: LocationCatalog shared within the process
+    """
+    # Only catalog of the public API is persisted, other urls (e.g. local stand-ins) are kept in memory
+    cache_path = 'outs/cache/locations.json' if api_url == 'https://api.meteo.lt/v1/' else None
+    return LocationCatalog(api_url=api_url, cache_path=cache_path)
@@ -1,38 +1,234 @@
 import datetime
-import time
+import itertools
+import math
+import operator
+import os
 from pprint import pprint
 
 import numpy as np
 import pandas as pd
-import requests
 from zoneinfo import ZoneInfo
-from tqdm import tqdm
+import aggregates
+import http_client
+import instrumentation
+import storage
 import utils
 
-import plotly.express as px
+OBSERVATION_TEXT_FIELDS = {'conditionCode'}  # other observation fields are numeric
+
+
+class ObservationsIncomplete(RuntimeError):
+    """
+    Some station days were not retrieved after all retries, the retrieved days are cached already
+    """
+    def __init__(self, failed_days: list):
+        self.failed_days = failed_days
+        super().__init__(f"{len(failed_days)} station days were not retrieved, rerun to retrieve them: {failed_days}")
+
+
+@instrumentation.timed('fetch')
+def fetch_observations(station_dates: dict, api_url: str = 'https://api.meteo.lt/v1/',
+                       observation_cache: storage.ObservationCache = None,
+                       max_workers: int = http_client.MAX_WORKERS) -> dict:
+    """
+    Retrieves observations of each (station, date). Requests of all stations are scheduled through one
+    pool on a keep-alive session, token bucket keeps the API constraint of 180 req/min.
+    Complete days are taken from observation_cache, only missing or incomplete days are requested.
+    Days which fail after all retries (or are not recorded in replay mode) are not cached. The rest of the batch
+    is still retrieved and cached, then ObservationsIncomplete listing the failed days is raised.
+    :param station_dates: {station_code: list of dates as "%Y-%m-%d" strings}
+    :param api_url: API root url
+    :param observation_cache: storage.ObservationCache, None disables the cache
+    :param max_workers: number of requests kept in flight
+    :return: {station_code: list of daily lists of observations ordered by date}
+    :raises ObservationsIncomplete: if some days were not retrieved
+    """
+    # Taking complete days from the local cache
+    observations_by_day = {}
+    if observation_cache is not None:
+        for station_code, dates in station_dates.items():
+            for date in dates:
+                observations_by_day[station_code, date] = observation_cache.get(station_code, date)
+    days_to_fetch = [(station_code, date) for station_code, dates in station_dates.items() for date in dates
+                     if observations_by_day.get((station_code, date)) is None]
+
+    # Structuring list of request urls for each station day
+    urls = [f"{api_url}stations/{station_code}/observations/{date}" for station_code, date in days_to_fetch]
+
+    # Retrieving data in json for each station day, every day is cached as soon as it arrives,
+    # so days of an interrupted or partly failed run are not downloaded again
+    failed_days = []
+    for i, url_data, error in http_client.iter_json_completed(urls, max_workers=max_workers) if urls else []:
+        (station_code, date), url = days_to_fetch[i], urls[i]
+        if error is not None:
+            print(f"Failed to retrieve {url}: {error!r}")
+            failed_days.append((station_code, date))
+            continue
+        else:
+            try:
+                url_data = url_data['observations']
+            except (KeyError, TypeError):
+                print(f"No observations in {url}:")
+                pprint(url_data)
+                url_data = []
+            else:
+                if observation_cache is not None:
+                    observation_cache.put(station_code, date, url_data)
+
+        observations_by_day[station_code, date] = url_data
+
+    if failed_days:
+        raise ObservationsIncomplete(failed_days)
+
+    return {station_code: [observations_by_day[station_code, date] for date in dates]
+            for station_code, dates in station_dates.items()}
+
+
+@instrumentation.timed('process_data')
+def observations_to_frame(observations_days: list, station_code: str) -> pd.DataFrame:
+    """
+    Parses observation json straight into typed columns instead of building a DataFrame from a list of dicts.
+    Column buffers are allocated once for all observations and filled day by day,
+    timestamps are parsed into int64, indexed frame is built once at the end.
+    :param observations_days: list of daily lists of observations (see fetch_observations)
+    :param station_code: station of the observations
+    :return: pd.DataFrame() with observation data indexed by observationTimeUtc (same as process_historic_data)
+    """
+    n_observations = sum(len(observations) for observations in observations_days)
+
+    # Fields of all days, a field may be missing (or null) on some days
+    fields = [field for field in dict.fromkeys(itertools.chain.from_iterable(itertools.chain.from_iterable(
+        observations_days))) if field != 'observationTimeUtc']
+
+    # Numeric measurements go to float64 buffers, texts to object buffers. Known text fields are fixed,
+    # type of other fields is taken from their first non-null value
+    text_fields = {field for field in fields if field in OBSERVATION_TEXT_FIELDS}
+    unresolved = set(fields) - text_fields
+    for observation in itertools.chain.from_iterable(observations_days):
+        if not unresolved:
+            break
+        for field in list(unresolved):
+            value = observation.get(field)
+            if value is not None:
+                unresolved.discard(field)
+                if isinstance(value, str):
+                    text_fields.add(field)
+
+    buffers = {field: np.empty(n_observations, dtype=object if field in text_fields else 'float64') for field in fields}
+    time_buffer = np.empty(n_observations, dtype='int64')
+
+    # One pass over each day's observations, values are then written column by column
+    get_values = operator.itemgetter('observationTimeUtc', *fields)
+    position = 0
+    for observations in observations_days:
+        n = len(observations)
+        if not n:
+            continue
+        try:
+            columns = list(zip(*map(get_values, observations)))
+        except KeyError:  # some observation lacks a field
+            columns = list(zip(*([observation.get(field) for field in ['observationTimeUtc', *fields]]
+                                 for observation in observations)))
+        time_buffer[position:position + n] = np.array(columns[0], dtype='datetime64[ns]').view('int64')
+        for buffer, values in zip(buffers.values(), columns[1:]):
+            buffer[position:position + n] = values
+        position += n
+
+    data = {field: pd.Categorical(buffer) if buffer.dtype == object else buffer for field, buffer in buffers.items()}
+    data['station_code'] = pd.Categorical.from_codes(np.zeros(n_observations, dtype='int8'), categories=[station_code])
+
+    index = pd.DatetimeIndex(time_buffer.view('datetime64[ns]'), name='observationTimeUtc').tz_localize('UTC')
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+@instrumentation.timed('process_data')
+def process_historic_data(observations_data: pd.DataFrame, station_code: str) -> pd.DataFrame:
+    """
+
+    :param observations_data: df of observations within defined range
+    :param station_code: station of the observations
+    :return: pd.DataFrame() with observation data of defined date range
+    """
+
+
+    # Add station_code:
+    observations_data['station_code']=station_code
+
+    # Set observationTimeUtc as pd.DatetimeIndex (column is moved to the index without copying the frame)
+    observations_data.index = pd.DatetimeIndex(pd.to_datetime(observations_data.pop('observationTimeUtc'), utc=True),
+                                               name='observationTimeUtc')
+
+    return observations_data
+
+
+@instrumentation.timed('process_data')
+def process_forecast_data(data: dict) -> pd.DataFrame:
+    """
+    Structures long-term forecast json into pd.DataFrame
+    :param data: json of /places/{code}/forecasts/long-term
+    :return: pd.DataFrame, kur indeksas yra laikas (pd.DatetimeIndex) su įvertinta laiko zona;
+    """
+
+    df_forecast=pd.DataFrame(data['forecastTimestamps'])
+    df_forecast.loc[:,'forecastCreationTimeUtc']=pd.Timestamp(data['forecastCreationTimeUtc'], tz='UTC')
+    df_forecast.loc[:,'forecastType']=data['forecastType']
+
+    place_meta=data['place']
+    df_forecast.loc[:, 'administrativeDivision'] = place_meta['administrativeDivision']
+    df_forecast.loc[:, 'code'] = place_meta['administrativeDivision']
+    df_forecast.loc[:, 'latitude'] = place_meta['coordinates']["latitude"]
+    df_forecast.loc[:, 'longitude'] = place_meta['coordinates']["longitude"]
+    df_forecast.loc[:, 'country'] = place_meta['country']
+    df_forecast.loc[:, 'countryCode'] = place_meta['countryCode']
+    df_forecast.loc[:, 'name'] = place_meta['name']
+
+    # Set observationTimeUtc as pd.DatetimeIndex
+    df_forecast.loc[:, 'forecastTimeUtc'] = pd.to_datetime(df_forecast['forecastTimeUtc'],utc=True)
+    df_forecast = df_forecast.set_index(pd.DatetimeIndex(df_forecast['forecastTimeUtc']))
+    df_forecast = df_forecast.drop(['forecastTimeUtc'], axis=1)
+
+    # Adding LT time for future analysis
+    df_forecast['forecastTime_LT'] = df_forecast.index.tz_convert(
+        ZoneInfo("Europe/Vilnius"))  # should take into account daylight saving time as well
+
+    return  df_forecast
 
 
 class DataMeteo:
     def __init__(self,
                  api_url:str = 'https://api.meteo.lt/v1/',
                  station_code:str = None, #location id for historical data
-                 place_code:str = None): #location id for forcast data
+                 place_code:str = None, #location id for forcast data
+                 cache_dir:str = 'outs/cache', #local cache of downloaded data, None disables it
+                 validate:bool = True): #check location codes against the API catalog
 
         self.api_url = api_url
-        self.station_code = utils.validate_location_code(station_code, location_type='station')
-        self.place_code = utils.validate_location_code(place_code, location_type='place')
+        if validate:
+            self.station_code = utils.validate_location_code(station_code, location_type='station', api_url=api_url)
+            self.place_code = utils.validate_location_code(place_code, location_type='place', api_url=api_url)
+        else:
+            self.station_code = station_code
+            self.place_code = place_code
         self.historic_data=None
         self.forecast_data = None
 
-    def get_historic_data(self, date_from: str, date_to: str, path_df_from_csv=None):
+        self.observation_cache = storage.ObservationCache(os.path.join(cache_dir, 'observations')) if cache_dir else None
+        self.forecast_archive = storage.ForecastArchive(os.path.join(cache_dir, 'forecasts')) if cache_dir else None
+
+    def get_historic_data(self, date_from: str, date_to: str, path_df_from_csv=None, path_df_from_parquet=None,
+                          max_workers: int = http_client.MAX_WORKERS, use_cache: bool = True):
         """
         Retrieves historical observation data within defined date range
-        First, get_data() gets the list of observations via API
-        Second, process_data() structures into pd.DataFrame with datetime index
+        First, get_data() gets the observations via API and parses them into pd.DataFrame with datetime index
+        (data loaded from csv is structured by process_historic_data())
 
         :param date_from: lower range of date range(inclusive)
         :param date_to: upper range of date range(inclusive)
         :param path_df_from_csv: can load data from csv for processing
+        :param path_df_from_parquet: can load typed data from parquet file or dataset (see save_historic_data),
+            only the defined date range is read
+        :param max_workers: number of requests kept in flight
+        :param use_cache: take already downloaded complete days from the local cache instead of the API
         :return: pd.DataFrame with observation data of defined date range
         """
         def get_data() -> pd.DataFrame:
@@ -45,116 +241,162 @@ class DataMeteo:
             dates=pd.date_range(start=date_from,end=date_to)
             dates_strings = [date.strftime("%Y-%m-%d") for date in dates]
 
-            # Structuring list of request urls for each date
-            url_root=f"https://api.meteo.lt/v1/stations/{self.station_code}/observations"
-            urls=[f"{url_root}/{str(date)}" for date in dates_strings]
-
-            # Calculating time to sleep between requests to follow API constraints
-            time_sleep=utils.calculate_sleep_time(requests_to_make=len(urls))
-
-            # Retrieving data in json for each date
-            # observations_date_range=[requests.get(url).json()['observations'] for url in urls]
-            observations_date_range = []
-
-            for url in tqdm(urls):
-
-                url_data=requests.get(url).json()
-                time.sleep(time_sleep)
-                try:
-                    url_data = url_data['observations']
-                except KeyError as KE:
-                    error_too_many_requests = url_data=={'error': {'code': 429, 'message': 'Too Many Requests'}}
-
-                    if error_too_many_requests:
-                        print("Sleeping 60 sec... too many requests...")
-                        time.sleep(60)
-                        print("Trying again...")
-                        url_data = requests.get(url).json()
-                        url_data=url_data['observations']
-                    else:
-                        pprint(url_data)
-
-                observations_date_range.append(url_data)
-
-            # Flattening list of lists of observations within each date
-            observations_date_range_flat= [item for sublist in observations_date_range for item in sublist]
-
-
-            return pd.DataFrame(observations_date_range_flat)
-
-        def process_data(observations_data: pd.DataFrame) -> pd.DataFrame:
-            """
-
-            :param observations_data: df of observations within defined range
-            :return: pd.DataFrame() with observation data of defined date range
-            """
-
+            observations = fetch_observations({self.station_code: dates_strings}, api_url=self.api_url,
+                                              observation_cache=self.observation_cache if use_cache else None,
+                                              max_workers=max_workers)
+            return observations_to_frame(observations[self.station_code], self.station_code)
 
-            # Add station_code:
-            observations_data.loc[:, 'station_code']=self.station_code
+        # Parquet data is already typed and indexed, no processing needed
+        if path_df_from_parquet:
+            import pyarrow.dataset as ds
 
-            # Set observationTimeUtc as pd.DatetimeIndex
-            observations_data.loc[:,'observationTimeUtc'] = pd.to_datetime(observations_data['observationTimeUtc'],utc=True)
-            observations_data = observations_data.set_index(pd.DatetimeIndex(observations_data['observationTimeUtc']))
-            observations_data=observations_data.drop(['observationTimeUtc'], axis=1)
+            # Multi-station archives are read for the station of the object only
+            filters = None
+            if 'station_code' in storage.dataset_columns(path_df_from_parquet):
+                filters = ds.field('station_code') == self.station_code
+            self.historic_data = storage.read_frame(path_df_from_parquet, date_from=date_from, date_to=date_to,
+                                                    filters=filters)
+            return self
 
-            return observations_data
-
-        # Getting the raw historic data
+        # Getting the historic data, API responses are parsed straight into the indexed frame
         if not path_df_from_csv:
             # Retrieve historic data
             self.historic_data=get_data()
         else:
             self.historic_data=pd.read_csv(path_df_from_csv)
 
-        # Process historic data
-        self.historic_data=process_data(self.historic_data)
+            # Process historic data
+            self.historic_data=process_historic_data(self.historic_data, self.station_code)
         return self
 
     def save_historic_data(self, path):
-        self.historic_data.to_csv(path)
+        """
+        Saves historic data. Paths ending with .parquet are saved in typed columnar format, others in csv
+        """
+        if path.endswith('.parquet'):
+            storage.save_frame(self.historic_data, path)
+        else:
+            self.historic_data.to_csv(path)
+
+    def save_forecast_data(self, path):
+        """
+        Saves forecast data in typed columnar format (parquet)
+        """
+        storage.save_frame(self.forecast_data, path)
 
 
     def get_forecast_data(self):
         """
+        Every downloaded forecast vintage is appended to the forecast archive (if cache_dir is defined).
+        Forecast is requested conditionally, unchanged forecast is taken from the archive.
         :return: pd.DataFrame, kur indeksas yra laikas (pd.DatetimeIndex) su įvertinta laiko zona;
         """
+        @instrumentation.timed('fetch')
         def get_data():
-            url_root=f"https://api.meteo.lt/v1/places/{self.place_code}/forecasts/long-term" # all places have long-term forecasts only
-            data=requests.get(url_root).json()
+            url_root=f"{self.api_url}places/{self.place_code}/forecasts/long-term" # all places have long-term forecasts only
+            if self.forecast_archive is None:
+                return http_client.get_json(url_root)
+
+            data, validators = http_client.get_json_conditional(
+                url_root, validators=self.forecast_archive.validators(self.place_code))
+            instrumentation.METRICS.inc('cache_misses' if data is not None else 'cache_hits', cache='forecasts')
+            self.forecast_archive.set_validators(self.place_code, validators)
             return data
 
-        def process_data(data):
+        forecast_data = get_data()
 
-            df_forecast=pd.DataFrame(data['forecastTimestamps'])
-            # df_forecast.loc[:,'forecastCreationTimeUtc']=data['forecastCreationTimeUtc']
-            df_forecast.loc[:,'forecastType']=data['forecastType']
+        if forecast_data is None:
+            # Not modified since the last request, archived json is processed the same way as a downloaded one
+            forecast_data = self.forecast_archive.latest_response(self.place_code)
+            if forecast_data is None:
+                self.forecast_archive.set_validators(self.place_code, {})
+                forecast_data = get_data()
 
-            place_meta=data['place']
-            df_forecast.loc[:, 'administrativeDivision'] = place_meta['administrativeDivision']
-            df_forecast.loc[:, 'code'] = place_meta['administrativeDivision']
-            df_forecast.loc[:, 'latitude'] = place_meta['coordinates']["latitude"]
-            df_forecast.loc[:, 'longitude'] = place_meta['coordinates']["longitude"]
-            df_forecast.loc[:, 'country'] = place_meta['country']
-            df_forecast.loc[:, 'countryCode'] = place_meta['countryCode']
-            df_forecast.loc[:, 'name'] = place_meta['name']
+        self.forecast_data = process_forecast_data(forecast_data)
+        if self.forecast_archive is not None:
+            self.forecast_archive.append(self.place_code, self.forecast_data, forecast_data)
+        return self
 
-            # Set observationTimeUtc as pd.DatetimeIndex
-            df_forecast.loc[:, 'forecastTimeUtc'] = pd.to_datetime(df_forecast['forecastTimeUtc'],utc=True)
-            df_forecast = df_forecast.set_index(pd.DatetimeIndex(df_forecast['forecastTimeUtc']))
-            df_forecast = df_forecast.drop(['forecastTimeUtc'], axis=1)
 
-            # Adding LT time for future analysis
-            df_forecast['forecastTime_LT'] = df_forecast.index.tz_convert(
-                ZoneInfo("Europe/Vilnius"))  # should take into account daylight saving time as well
+class DataMeteoBatch:
+    """
+    Retrieves data of many stations and places at once.
+    All (station, day) requests share one pool and the global API quota, results are combined into long format frames.
+    """
+    def __init__(self,
+                 api_url:str = 'https://api.meteo.lt/v1/',
+                 station_codes:list = None, #location ids for historical data
+                 place_codes:list = None, #location ids for forcast data
+                 cache_dir:str = 'outs/cache', #local cache of downloaded data, None disables it
+                 validate:bool = True): #check location codes against the API catalog
 
-            return  df_forecast
+        self.api_url = api_url
+        self.station_codes = [code for code in station_codes or [] if not validate
+                              or utils.validate_location_code(code, location_type='station', api_url=api_url)]
+        self.place_codes = [code for code in place_codes or [] if not validate
+                            or utils.validate_location_code(code, location_type='place', api_url=api_url)]
+        self.historic_data = None
+        self.forecast_data = None
 
-        forecast_data = get_data()
+        self.observation_cache = storage.ObservationCache(os.path.join(cache_dir, 'observations')) if cache_dir else None
+        self.forecast_archive = storage.ForecastArchive(os.path.join(cache_dir, 'forecasts')) if cache_dir else None
 
-        self.forecast_data = process_data(forecast_data)
+    def get_historic_data(self, date_from: str, date_to: str,
+                          max_workers: int = http_client.MAX_WORKERS, use_cache: bool = True):
+        """
+        Retrieves historical observation data of all stations within defined date range
+        :param date_from: lower range of date range(inclusive)
+        :param date_to: upper range of date range(inclusive)
+        :param max_workers: number of requests kept in flight
+        :param use_cache: take already downloaded complete days from the local cache instead of the API
+        :return: pd.DataFrame indexed by (station_code, observationTimeUtc)
+        """
+        dates_strings = [date.strftime("%Y-%m-%d") for date in pd.date_range(start=date_from, end=date_to)]
+
+        observations = fetch_observations({station_code: dates_strings for station_code in self.station_codes},
+                                          api_url=self.api_url,
+                                          observation_cache=self.observation_cache if use_cache else None,
+                                          max_workers=max_workers)
+
+        frames = [observations_to_frame(observations[station_code], station_code)
+                  for station_code in self.station_codes if any(observations[station_code])]
+        self.historic_data = to_long_format(frames, 'station_code')
         return self
 
+    def get_forecast_data(self, max_workers: int = http_client.MAX_WORKERS):
+        """
+        Retrieves long-term forecasts of all places
+        :param max_workers: number of requests kept in flight
+        :return: pd.DataFrame indexed by (place_code, forecastTimeUtc)
+        """
+        urls = [f"{self.api_url}places/{place_code}/forecasts/long-term" for place_code in self.place_codes]
+        with instrumentation.stage('fetch'):
+            url_responses = http_client.get_json_many(urls, max_workers=max_workers) if urls else []
+
+        frames = []
+        for place_code, data in zip(self.place_codes, url_responses):
+            df_forecast = process_forecast_data(data)
+            if self.forecast_archive is not None:
+                self.forecast_archive.append(place_code, df_forecast, data)
+            df_forecast.loc[:, 'place_code'] = place_code
+            frames.append(df_forecast)
+        self.forecast_data = to_long_format(frames, 'place_code')
+        return self
+
+
+def to_long_format(frames: list, location_column: str) -> pd.DataFrame:
+    """
+    Concatenates frames of several locations into one frame indexed by (location, time)
+    :param frames: list of pd.DataFrame with pd.DatetimeIndex
+    :param location_column: 'station_code' or 'place_code'
+    :return: pd.DataFrame with pd.MultiIndex
+    """
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames)
+    df = df.set_index(location_column, append=True).swaplevel(0, 1)
+    return df.sort_index()
+
 
 class HistAnalysis:
     def __init__(self, df_hist, df_forecast=None):
@@ -169,44 +411,112 @@ class HistAnalysis:
 
         self.df_hist_n_forecast = None
         self.fig_hist_n_forecast = None
+        self.df_aligned = None
 
+    @instrumentation.timed('processing')
     def processing(self):
+        # Sorting by time (same order as by local time), already sorted data is not copied
+        if not self.df_hist.index.is_monotonic_increasing:
+            self.df_hist = self.df_hist.sort_index(kind='stable')
+
         self.df_hist['observationTime_LT'] = self.df_hist.index.tz_convert(
             ZoneInfo("Europe/Vilnius"))  # should take into account daylight saving time as well
 
+        # Calendar features are gathered from the cached hourly calendar instead of deriving them row by row
+        calendar = utils.calendar_for_index(self.df_hist.index)
+
         # Adding date for later aggregations
-        self.df_hist['Time_LT_date'] = self.df_hist['observationTime_LT'].dt.date
-        # self.df_hist['observationTime_LT_time'] = self.df_hist['observationTime_LT'].dt.time
+        self.df_hist['Time_LT_date'] = calendar['Time_LT_date']
 
         # Flagging day measurements
-        self.df_hist['Time_LT_is_daytime'] = self.df_hist['observationTime_LT'].dt.hour.between(8, 20)
+        self.df_hist['Time_LT_is_daytime'] = calendar['Time_LT_is_daytime']
 
         # Indexing weekend within given period (for weekend forcast data)
-        # If df_hist['Time_LT_weekend_rank'] value is none - measurement was done not on weekend
-        self.df_hist = self.df_hist.sort_values(by='observationTime_LT', ascending=True)
-        self.df_hist['Time_LT_is_weekend'] = self.df_hist['observationTime_LT'].dt.dayofweek>4 # days are indexed in python, therefore monday: 0, thuesday:1, etc...
-        self.df_hist['Time_LT_weekend_rank'] = self.df_hist['observationTime_LT'].dt.to_period('W-SUN')  # Group by ISO week (ending Sunday)
-        self.df_hist['Time_LT_weekend_rank'] = self.df_hist['Time_LT_weekend_rank'].rank(method='dense')
-        self.df_hist['Time_LT_weekend_rank'] = np.where(self.df_hist["Time_LT_is_weekend"], self.df_hist["Time_LT_weekend_rank"], None)
-
-
-        self.df_hist = self.df_hist.drop(["Time_LT_is_weekend",
-                                          # "observationTime_LT",
-                                          ], axis=1)
+        # If df_hist['Time_LT_weekend_rank'] value is <NA> - measurement was done not on weekend
+        _, week_rank = np.unique(calendar['Time_LT_week'], return_inverse=True)  # dense rank of Monday-Sunday weeks
+        self.df_hist['Time_LT_weekend_rank'] = pd.arrays.IntegerArray(week_rank.astype('int64') + 1,
+                                                                      mask=~calendar['Time_LT_is_weekend'])
         return self
 
-    def get_mean_metrics(self):
-        df_h_temp=self.df_hist
-        self.temp_mean = df_h_temp['airTemperature'].mean()
-        self.temp_mean_day = df_h_temp.loc[df_h_temp["Time_LT_is_daytime"],'airTemperature'].mean()
-        self.temp_mean_night = df_h_temp.loc[~df_h_temp["Time_LT_is_daytime"], 'airTemperature'].mean()
+    def get_metrics_dict(self) -> dict:
+        """
+        :return: metrics computed by get_mean_metrics()
+        """
+        return {
+            'temp_mean': self.temp_mean,
+            'temp_mean_day': self.temp_mean_day,
+            'temp_mean_night': self.temp_mean_night,
+            'humid_mean': self.humid_mean,
+            'n_weekends_w_precip': self.n_weekends_w_precip,
+        }
+
+    def get_partial_metrics(self) -> dict:
+        """
+        Sums and counts behind get_mean_metrics. Partial metrics of chunks of the history are merged
+        with merge_partial_metrics, sums are exact so the result does not depend on the chunking
+        :return: dict of exact sums (see aggregates.exact_sum), counts and set of weekends with precipitation
+        """
+        # Observations without timestamp (NaT) can not be placed in time and are left out
+        df_h_temp = self.df_hist
+        if df_h_temp.index.hasnans:
+            df_h_temp = df_h_temp.loc[df_h_temp.index.notna()]
+        temp = df_h_temp['airTemperature'].to_numpy(dtype='float64', na_value=np.nan)
+        humid = df_h_temp['relativeHumidity'].to_numpy(dtype='float64', na_value=np.nan)
+        precip = df_h_temp['precipitation'].to_numpy(dtype='float64', na_value=np.nan)
+        is_daytime = df_h_temp['Time_LT_is_daytime'].to_numpy(dtype=bool)
+
+        # Weekends are identified by Monday-Sunday week number, rank of processing() is local to the chunk
+        week = utils.calendar_for_index(df_h_temp.index)['Time_LT_week']
+        is_weekend_w_precip = df_h_temp['Time_LT_weekend_rank'].notna().to_numpy() & (precip > 0)
+
+        return {
+            'temp_sum_day': aggregates.exact_sum(temp[is_daytime]),
+            'temp_count_day': int((~np.isnan(temp[is_daytime])).sum()),
+            'temp_sum_night': aggregates.exact_sum(temp[~is_daytime]),
+            'temp_count_night': int((~np.isnan(temp[~is_daytime])).sum()),
+            'humid_sum': aggregates.exact_sum(humid),
+            'humid_count': int((~np.isnan(humid)).sum()),
+            'weekends_w_precip': set(np.unique(week[is_weekend_w_precip]).tolist()),
+        }
+
+    @staticmethod
+    def merge_partial_metrics(partials: list) -> dict:
+        """
+        :param partials: list of get_partial_metrics() results
+        :return: merged partial metrics
+        """
+        merged = {'temp_sum_day': [], 'temp_count_day': 0, 'temp_sum_night': [], 'temp_count_night': 0,
+                  'humid_sum': [], 'humid_count': 0, 'weekends_w_precip': set()}
+        for partial in partials:
+            for name, value in partial.items():
+                merged[name] = merged[name] | value if name == 'weekends_w_precip' else merged[name] + value
+        return merged
+
+    def set_metrics(self, partial: dict):
+        """
+        Sets metrics of get_mean_metrics from (merged) partial metrics
+        :return: self
+        """
+        def mean(sum_components: list, count: int) -> float:
+            return math.fsum(sum_components) / count if count else np.nan
+
+        self.temp_mean = mean(partial['temp_sum_day'] + partial['temp_sum_night'],
+                              partial['temp_count_day'] + partial['temp_count_night'])
+        self.temp_mean_day = mean(partial['temp_sum_day'], partial['temp_count_day'])
+        self.temp_mean_night = mean(partial['temp_sum_night'], partial['temp_count_night'])
+        self.humid_mean = mean(partial['humid_sum'], partial['humid_count'])
+        self.n_weekends_w_precip = len(partial['weekends_w_precip'])
+        return self
 
-        self.humid_mean = df_h_temp['relativeHumidity'].mean()
+    @instrumentation.timed('metrics')
+    def get_mean_metrics(self, verbose=True):
+        """
+        :param verbose: print the results
+        """
+        self.set_metrics(self.get_partial_metrics())
 
-        weekend_with_precip=(
-            df_h_temp.loc[(df_h_temp["Time_LT_weekend_rank"] is not None) & (df_h_temp["precipitation"] > 0)].agg({"Time_LT_weekend_rank": 'nunique'})
-        )
-        self.n_weekends_w_precip = weekend_with_precip.iloc[0]
+        if not verbose:
+            return self
 
         print('Question 2: Metrics of defined time frame')
         print(f"Mean temp: {self.temp_mean}")
@@ -221,23 +531,20 @@ class HistAnalysis:
 
     def compare_hist_n_forecast(self, show_figure=False):
         def get_last_week_data_ISO(df_h):
-            df_h['ISO_week'] = df_h['observationTime_LT'].dt.isocalendar().week
+            # Previous ISO week (Monday to Sunday) in local time
+            date_today = datetime.datetime.now(ZoneInfo("Europe/Vilnius")).date()
+            week_start = date_today - datetime.timedelta(days=date_today.weekday() + 7)
+            time_from = pd.Timestamp(week_start, tz=ZoneInfo("Europe/Vilnius"))
+            time_to = time_from + pd.DateOffset(weeks=1)
 
-            # Get today's ISO week
-            iso_week_today = datetime.date.today().isocalendar()
-            iso_week_today = iso_week_today[1]
-
-            # Keep the earlier week data
-            df_h = df_h.loc[df_h['ISO_week']==iso_week_today-1, :]
-            df_h = df_h.drop('ISO_week', axis=1)
-            return df_h
+            # Keep the earlier week data, sliced from sorted time index
+            return utils.slice_time(df_h, time_from, time_to)
 
 
         # Process column names prior to concat
         # PROCESS HISTORIC DATA
-        df_h_temp = self.df_hist
+        df_h_temp = get_last_week_data_ISO(self.df_hist)
         df_h_temp = df_h_temp.loc[:, ["observationTime_LT", "airTemperature"]]
-        df_h_temp = get_last_week_data_ISO(df_h_temp)
         df_h_temp.loc[:,'type'] = 'historic'
         df_h_temp.rename(columns={"observationTime_LT":"Time_LT"},inplace=True)
 
@@ -252,7 +559,10 @@ class HistAnalysis:
 
         self.df_hist_n_forecast=df
         
-        fig=px.scatter(df, 'Time_LT', 'airTemperature', color='type', title="3 Užduotis:")
+        import plotly.express as px  # imported only when figure is made, it is slow to import
+
+        with instrumentation.stage('plot'):
+            fig=px.scatter(df, 'Time_LT', 'airTemperature', color='type', title="3 Užduotis:", render_mode='webgl')
 
         self.fig_hist_n_forecast=fig
 
@@ -262,7 +572,89 @@ class HistAnalysis:
 
         return self
 
+    def align_hist_n_forecast(self, date_from=None, date_to=None, variables: list = None, tolerance: str = '30min'):
+        """
+        Joins each forecast timestamp of the window with the nearest observation (see utils.align_hist_n_forecast)
+        :param date_from: lower range of the window (inclusive), start of forecast by default
+        :param date_to: upper range of the window (exclusive), end of forecast by default
+        :param variables: variables to align, default ['airTemperature']
+        :param tolerance: maximum distance between forecast and observation timestamps
+        :return: self, result is in self.df_aligned
+        """
+        self.df_aligned = utils.align_hist_n_forecast(self.df_hist, self.df_forecast, date_from, date_to,
+                                                      variables=variables, tolerance=tolerance)
+        return self
 
 
-
-
+def analyze_stations(df_hist: pd.DataFrame, max_workers: int = None) -> pd.DataFrame:
+    """
+    Runs HistAnalysis.processing() and get_mean_metrics() for each station in a separate process.
+    Station partitions are handed over as Arrow IPC files in shared memory (/dev/shm where available),
+    which workers memory-map instead of unpickling copies of the frames.
+    :param df_hist: observations with station_code column, or long format frame indexed by (station_code, time)
+    :param max_workers: number of processes, number of CPUs by default
+    :return: pd.DataFrame indexed by station_code with the metrics of get_mean_metrics
+    """
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    import pyarrow as pa
+
+    if isinstance(df_hist.index, pd.MultiIndex):
+        df_hist = df_hist.reset_index(level=0)
+
+    shared_memory_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=shared_memory_dir) as partitions_dir:
+        paths = {}
+        for i, (station_code, df_station) in enumerate(df_hist.groupby('station_code', sort=False, observed=True)):
+            paths[station_code] = os.path.join(partitions_dir, f"{i}.arrow")
+            table = pa.Table.from_pandas(df_station, preserve_index=True)
+            with pa.OSFile(paths[station_code], 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            metrics = dict(zip(paths, executor.map(_analyze_station_partition, paths.values())))
+
+    return pd.DataFrame.from_dict(metrics, orient='index').rename_axis('station_code')
+
+
+def _analyze_station_partition(path: str) -> dict:
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        df_station = pa.ipc.open_file(source).read_all().to_pandas()
+    history_analysis = HistAnalysis(df_hist=df_station).processing().get_mean_metrics(verbose=False)
+    return history_analysis.get_metrics_dict()
+
+
+def analyze_archive(path: str, date_from=None, date_to=None, station_codes: list = None,
+                    chunk_rows: int = 24 * 366) -> pd.DataFrame:
+    """
+    Out-of-core version of HistAnalysis.processing() and get_mean_metrics() for archives larger than memory.
+    Archive is streamed in chunks (see storage.iter_frames), each chunk is processed separately and
+    partial metrics are merged per station, so results equal the in-memory analysis of the whole archive
+    while peak memory depends only on chunk_rows.
+    :param path: parquet file or dataset saved with storage.save_frame (e.g. partition_cols=['station_code'])
+    :param date_from: lower range of date range(inclusive)
+    :param date_to: upper range of date range(inclusive)
+    :param station_codes: stations to analyse, all by default
+    :param chunk_rows: maximum number of observations in memory at once
+    :return: pd.DataFrame indexed by station_code with the metrics of get_mean_metrics
+    """
+    import pyarrow.dataset as ds
+
+    filters = ds.field('station_code').isin(station_codes) if station_codes is not None else None
+    columns = ['airTemperature', 'relativeHumidity', 'precipitation', 'station_code']
+
+    partials = {}
+    for df_chunk in storage.iter_frames(path, columns=columns, date_from=date_from, date_to=date_to,
+                                        filters=filters, batch_rows=chunk_rows):
+        for station_code, df_station in df_chunk.groupby('station_code', sort=False, observed=True):
+            history_analysis = HistAnalysis(df_hist=df_station.copy()).processing()
+            partials.setdefault(station_code, []).append(history_analysis.get_partial_metrics())
+
+    metrics = {}
+    for station_code, station_partials in partials.items():
+        history_analysis = HistAnalysis(df_hist=None).set_metrics(HistAnalysis.merge_partial_metrics(station_partials))
+        metrics[station_code] = history_analysis.get_metrics_dict()
+    return pd.DataFrame.from_dict(metrics, orient='index').rename_axis('station_code')
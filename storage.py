@@ -0,0 +1,336 @@
+import datetime
+import gzip
+import json
+import os
+
+import pandas as pd
+
+from instrumentation import METRICS
+
+# Observations of the last hours of the day are published with a delay,
+# therefore day is treated as complete only some time after it has ended (UTC)
+DAY_COMPLETE_AFTER = datetime.timedelta(hours=3)
+
+
+def is_day_complete(date, now: datetime.datetime = None) -> bool:
+    """
+    :param date: date of observations (UTC)
+    :param now: tz-aware datetime, defaults to current UTC time
+    :return: True if no more observations are expected for the date
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    day_end = datetime.datetime.combine(pd.Timestamp(date).date() + datetime.timedelta(days=1),
+                                        datetime.time(), tzinfo=datetime.timezone.utc)
+    return now >= day_end + DAY_COMPLETE_AFTER
+
+
+class ObservationCache:
+    """
+    Local cache of raw observations partitioned by (station_code, date): one json file per station day.
+    Days which can still receive new observations (e.g. today) are stored as incomplete and fetched again.
+    """
+    def __init__(self, cache_dir: str = 'outs/cache/observations'):
+        self.cache_dir = cache_dir
+
+    def _path(self, station_code: str, date) -> str:
+        date = pd.Timestamp(date).strftime("%Y-%m-%d")
+        return os.path.join(self.cache_dir, station_code, f"{date}.json")
+
+    def get(self, station_code: str, date):
+        """
+        :return: list of observations of complete day, None if the day is missing or incomplete
+        """
+        path = self._path(station_code, date)
+        if not os.path.exists(path):
+            METRICS.inc('cache_misses', cache='observations')
+            return None
+        with open(path, encoding='utf-8') as f:
+            partition = json.load(f)
+        if not partition['complete']:
+            METRICS.inc('cache_misses', cache='observations')
+            return None
+        METRICS.inc('cache_hits', cache='observations')
+        return partition['observations']
+
+    def put(self, station_code: str, date, observations: list):
+        """
+        Stores observations of one station day. File is replaced atomically so parallel readers never see half of it
+        """
+        path = self._path(station_code, date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partition = {'complete': is_day_complete(date), 'observations': observations}
+
+        path_tmp = f"{path}.{os.getpid()}.tmp"
+        with open(path_tmp, 'w', encoding='utf-8') as f:
+            json.dump(partition, f)
+        os.replace(path_tmp, path)
+
+
+# Rows are sorted by time before writing, so row group statistics let readers skip row groups outside a time range
+ROW_GROUP_SIZE = 24 * 31
+CATEGORICAL_COLUMNS = ['conditionCode', 'station_code', 'place_code', 'forecastType',
+                       'administrativeDivision', 'code', 'country', 'countryCode', 'name']
+
+
+def to_typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts frame to the storage schema: float32 measurements, categorical codes and texts,
+    tz-aware timestamps are kept as they are
+    :param df: historic or forecast pd.DataFrame with pd.DatetimeIndex
+    :return: pd.DataFrame
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            df[column] = df[column].astype('float32')
+    return df
+
+
+def save_frame(df: pd.DataFrame, path: str, partition_cols: list = None,
+               existing_data_behavior: str = 'overwrite_or_ignore'):
+    """
+    Saves typed frame to parquet.
+    :param df: pd.DataFrame with pd.DatetimeIndex
+    :param path: parquet file, or directory of the dataset if partition_cols are given
+    :param partition_cols: e.g. ['station_code'] to keep multi-station archive partitioned by station
+    :param existing_data_behavior: for datasets, 'overwrite_or_ignore' adds files to existing partitions,
+        'delete_matching' replaces partitions present in df (see pyarrow.dataset.write_dataset)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = to_typed_frame(df.sort_index())
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    if partition_cols:
+        pq.write_to_dataset(table, path, partition_cols=partition_cols, row_group_size=ROW_GROUP_SIZE,
+                            existing_data_behavior=existing_data_behavior)
+    else:
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        pq.write_table(table, path, row_group_size=ROW_GROUP_SIZE)
+
+
+def upsert_frame(df: pd.DataFrame, path: str, partition_cols: list = None, key_columns: list = None):
+    """
+    Saves frame like save_frame, merged with the data already saved in the path: rows with the same
+    index and key column values are replaced by df, other existing rows are kept. Only partitions present
+    in df are rewritten, so saving overlapping date ranges again (e.g. rolling refresh) does not duplicate rows.
+    :param df: pd.DataFrame with pd.DatetimeIndex
+    :param path: parquet file, or directory of the dataset if partition_cols are given
+    :param partition_cols: e.g. ['station_code']
+    :param key_columns: columns identifying a row together with the index, e.g. ['station_code'] for
+        multi-station frames saved to one file. Partition columns are always part of the key
+    """
+    import pyarrow.dataset as ds
+
+    partition_cols = partition_cols or []
+    key_columns = list(dict.fromkeys([*partition_cols, *(key_columns or [])]))
+    if os.path.exists(path):
+        filters = None
+        for column in partition_cols:
+            filters = _and(filters, ds.field(column).isin(df[column].astype(str).unique().tolist()))
+        df_existing = read_frame(path, filters=filters)
+        df = pd.concat([df_existing, df])
+        keys = pd.DataFrame({column: df[column].astype(str).to_numpy() for column in key_columns})
+        keys['index'] = df.index
+        df = df.loc[~keys.duplicated(keep='last').to_numpy()]
+
+    save_frame(df, path, partition_cols=partition_cols or None, existing_data_behavior='delete_matching')
+
+
+def read_frame(path: str, columns: list = None, date_from=None, date_to=None, filters=None) -> pd.DataFrame:
+    """
+    Reads parquet file or partitioned dataset. Only requested columns are read and
+    time range is pushed down to the reader, so row groups outside of it are skipped.
+    :param path: parquet file or dataset directory
+    :param columns: columns to read, all by default. Time index is always read
+    :param date_from: lower range of date range(inclusive)
+    :param date_to: upper range of date range(inclusive, whole day)
+    :param filters: additional pyarrow.dataset expression, e.g. ds.field('station_code') == 'vilniaus-ams'
+    :return: pd.DataFrame with tz-aware pd.DatetimeIndex
+    """
+    dataset, index_column, columns, expression = _scan(path, columns, date_from, date_to, filters)
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    return _set_time_index(df, index_column).sort_index()
+
+
+def iter_frames(path: str, columns: list = None, date_from=None, date_to=None, filters=None,
+                batch_rows: int = ROW_GROUP_SIZE * 12):
+    """
+    Streams parquet file or partitioned dataset in chunks of at most batch_rows rows (see read_frame),
+    so memory is bounded by the chunk size and not by the size of the dataset.
+    Chunks follow files and row groups: one station and consecutive time range each for datasets saved
+    with partition_cols=['station_code'], chunks are not sorted between each other.
+    :return: generator of pd.DataFrame with tz-aware pd.DatetimeIndex
+    """
+    import pyarrow as pa
+
+    dataset, index_column, columns, expression = _scan(path, columns, date_from, date_to, filters)
+
+    # Reader batches are not larger than row groups, they are gathered up to batch_rows
+    batches, n_rows = [], 0
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_rows,
+                                    batch_readahead=1, fragment_readahead=1):
+        if n_rows + batch.num_rows > batch_rows and batches:
+            yield _set_time_index(pa.Table.from_batches(batches).to_pandas(), index_column).sort_index()
+            batches, n_rows = [], 0
+        if batch.num_rows:
+            batches.append(batch)
+            n_rows += batch.num_rows
+    if batches:
+        yield _set_time_index(pa.Table.from_batches(batches).to_pandas(), index_column).sort_index()
+
+
+def dataset_columns(path: str) -> list:
+    """
+    :param path: parquet file or dataset directory
+    :return: column names of the file or dataset, partition columns included
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format='parquet', partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+    return dataset.schema.names
+
+
+def _scan(path: str, columns: list, date_from, date_to, filters):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format='parquet',
+                         partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+    index_column = dataset.schema.pandas_metadata['index_columns'][0]
+    index_type = dataset.schema.field(index_column).type
+
+    expression = filters
+    if date_from is not None:
+        time_from = _utc_timestamp(date_from)
+        expression = _and(expression, ds.field(index_column) >= ds.scalar(time_from).cast(index_type))
+    if date_to is not None:
+        time_to = _utc_timestamp(date_to).normalize() + pd.Timedelta(days=1)
+        expression = _and(expression, ds.field(index_column) < ds.scalar(time_to).cast(index_type))
+
+    if columns is not None:
+        columns = [index_column] + [column for column in columns if column != index_column]
+    return dataset, index_column, columns, expression
+
+
+def _set_time_index(df: pd.DataFrame, index_column: str) -> pd.DataFrame:
+    if index_column in df.columns:
+        df = df.set_index(index_column)
+    return df
+
+
+def _and(expression, other):
+    return other if expression is None else expression & other
+
+
+def _utc_timestamp(value) -> pd.Timestamp:
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+
+class ForecastArchive:
+    """
+    Append-only archive of forecast vintages: one parquet file per (place_code, forecastCreationTimeUtc),
+    partitioned by place_code, so all vintages can be read as one time-indexed dataset (see read_frame).
+    Validators of the last response (ETag, Last-Modified) are kept to make conditional requests,
+    together with the json of each vintage, so a not modified forecast is processed the same way as a downloaded one.
+    """
+    def __init__(self, archive_dir: str = 'outs/cache/forecasts'):
+        self.archive_dir = archive_dir
+
+    def _vintage_path(self, place_code: str, creation_time) -> str:
+        creation_time = _utc_timestamp(creation_time).strftime('%Y%m%dT%H%M%SZ')
+        return os.path.join(self.archive_dir, f"place_code={place_code}", f"{creation_time}.parquet")
+
+    def _validators_path(self, place_code: str) -> str:
+        # Files starting with "_" are ignored when reading the dataset
+        return os.path.join(self.archive_dir, '_validators', f"{place_code}.json")
+
+    def _response_path(self, place_code: str, creation_time) -> str:
+        creation_time = _utc_timestamp(creation_time).strftime('%Y%m%dT%H%M%SZ')
+        return os.path.join(self.archive_dir, '_responses', place_code, f"{creation_time}.json.gz")
+
+    def has_vintage(self, place_code: str, creation_time) -> bool:
+        return os.path.exists(self._vintage_path(place_code, creation_time))
+
+    def append(self, place_code: str, df_forecast: pd.DataFrame, data: dict = None) -> bool:
+        """
+        Stores forecast vintage unless it is archived already
+        :param df_forecast: processed forecast (see process_forecast_data) with forecastCreationTimeUtc column
+        :param data: json the forecast was processed from, kept for latest_response()
+        :return: True if new vintage was stored
+        """
+        creation_time = df_forecast['forecastCreationTimeUtc'].iloc[0]
+        if data is not None and not os.path.exists(self._response_path(place_code, creation_time)):
+            path = self._response_path(place_code, creation_time)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            path_tmp = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(path_tmp, 'wt', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(path_tmp, path)
+        if self.has_vintage(place_code, creation_time):
+            return False
+        # place_code comes from the partition directory
+        save_frame(df_forecast.drop(columns=['place_code'], errors='ignore'),
+                   self._vintage_path(place_code, creation_time))
+        return True
+
+    @staticmethod
+    def _latest_file(directory: str, extension: str):
+        if not os.path.isdir(directory):
+            return None
+        names = sorted(name for name in os.listdir(directory) if name.endswith(extension))
+        return os.path.join(directory, names[-1]) if names else None
+
+    def latest(self, place_code: str):
+        """
+        :return: the newest archived vintage of the place in storage schema (see to_typed_frame),
+            None if there is none
+        """
+        path = self._latest_file(os.path.dirname(self._vintage_path(place_code, pd.Timestamp(0))), '.parquet')
+        if path is None:
+            return None
+        # place_code is read from the partition directory, it is not a column of the stored vintage
+        return read_frame(path).drop(columns=['place_code'], errors='ignore')
+
+    def latest_response(self, place_code: str):
+        """
+        :return: json of the newest archived vintage of the place, None if there is none
+        """
+        path = self._latest_file(os.path.dirname(self._response_path(place_code, pd.Timestamp(0))), '.json.gz')
+        if path is None:
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def read(self, place_codes: list = None, date_from=None, date_to=None, columns: list = None) -> pd.DataFrame:
+        """
+        Reads all archived vintages
+        :param place_codes: places to read, all by default
+        :param date_from: lower range of forecast time(inclusive)
+        :param date_to: upper range of forecast time(inclusive, whole day)
+        :param columns: columns to read, all by default
+        :return: pd.DataFrame indexed by forecastTimeUtc with forecastCreationTimeUtc and place_code columns
+        """
+        import pyarrow.dataset as ds
+
+        filters = ds.field('place_code').isin(place_codes) if place_codes is not None else None
+        if columns is not None:
+            columns = list(dict.fromkeys(columns + ['forecastCreationTimeUtc', 'place_code']))
+        return read_frame(self.archive_dir, columns=columns, date_from=date_from, date_to=date_to, filters=filters)
+
+    def validators(self, place_code: str) -> dict:
+        path = self._validators_path(place_code)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def set_validators(self, place_code: str, validators: dict):
+        path = self._validators_path(place_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(validators, f)
@@ -1,6 +1,9 @@
+import inspect
 import streamlit as st
 import datetime
+import plotly.graph_objects as go
 import models
+import utils
 
 st.set_page_config(layout="wide")
 
@@ -55,23 +58,67 @@ st.code("""
 date_today = datetime.date.today().strftime('%Y-%m-%d')
 date_year_back = (datetime.date.today() - datetime.timedelta(days=365)).strftime('%Y-%m-%d')
 
-# Instance of the object
-weather_data = models.DataMeteo(station_code="vilniaus-ams", place_code='vilnius')
+STATION_CODE = "vilniaus-ams"
+PLACE_CODE = "vilnius"
+PATH_HISTORIC_DATA = "outs/weather_data.vilnius.historic.365.csv"
+MAX_POINTS_PER_TRACE = 2000  # charts are downsampled on the server to keep them interactive
 
-# FORECAST DATA
-weather_data = weather_data.get_forecast_data()
-# HISTORICAL DATA
-weather_data = weather_data.get_historic_data(date_from=date_year_back, date_to=date_today,
-                                              path_df_from_csv="outs/weather_data.vilnius.historic.365.csv"
-                                              )
+
+# Data layer is split into cached stages, so reruns of the page do not repeat downloads and processing.
+# Forecast is refreshed hourly, historic data comes from the bundled file and is keyed by date range only.
+@st.cache_data(ttl=datetime.timedelta(hours=1), show_spinner=False)
+def load_forecast_data(station_code, place_code):
+    weather_data = models.DataMeteo(station_code=station_code, place_code=place_code)
+    return weather_data.get_forecast_data().forecast_data
+
+
+@st.cache_data(show_spinner=False)
+def load_historic_data(station_code, place_code, date_from, date_to, path_df_from_csv):
+    weather_data = models.DataMeteo(station_code=station_code, place_code=place_code)
+    weather_data = weather_data.get_historic_data(date_from=date_from, date_to=date_to,
+                                                  path_df_from_csv=path_df_from_csv)
+    return weather_data.historic_data
+
+
+@st.cache_data(ttl=datetime.timedelta(hours=1), show_spinner=False)
+def load_analysis(station_code, place_code, date_from, date_to, path_df_from_csv):
+    history_analysis = models.HistAnalysis(
+        df_hist=load_historic_data(station_code, place_code, date_from, date_to, path_df_from_csv).copy(),
+        df_forecast=load_forecast_data(station_code, place_code))
+    history_analysis = history_analysis.processing()
+    history_analysis.get_mean_metrics(verbose=False)
+    history_analysis = history_analysis.compare_hist_n_forecast(show_figure=False)
+
+    return history_analysis.get_metrics_dict(), history_analysis.df_hist_n_forecast
+
+
+def line_chart_webgl(df, x, y, color, title):
+    """
+    WebGL line chart, each trace downsampled with LTTB to MAX_POINTS_PER_TRACE points
+    """
+    fig = go.Figure()
+    for name, df_trace in df.groupby(color, sort=False):
+        series = utils.downsample_lttb(df_trace.set_index(x)[y], n_out=MAX_POINTS_PER_TRACE)
+        fig.add_trace(go.Scattergl(x=series.index, y=series.to_numpy(), mode='markers', name=name,
+                                   marker={'size': 3}))
+    fig.update_layout(title=title, xaxis_title=x, yaxis_title=y)
+    return fig
+
+
+forecast_data = load_forecast_data(STATION_CODE, PLACE_CODE)
+historic_data = load_historic_data(STATION_CODE, PLACE_CODE, date_year_back, date_today, PATH_HISTORIC_DATA)
 
 st.markdown("""#### Preview of Historical data """)
 st.code("""weather_data.historic_data""")
-st.table(weather_data.historic_data.head())
+st.dataframe(historic_data.head())
 
 st.markdown("""#### Preview of Forecast data """)
 st.code("""weather_data.forecast_data""")
-st.table(weather_data.forecast_data.head())
+st.dataframe(forecast_data.head())
+
+st.plotly_chart(line_chart_webgl(historic_data.reset_index().assign(station_code=STATION_CODE),
+                                 'observationTimeUtc', 'airTemperature', 'station_code',
+                                 title="Istoriniai temperatūros duomenys"))
 
 st.markdown(
     """
@@ -94,20 +141,16 @@ st.code(
 
 
 # DATA ANALYSIS
-history_analysis = models.HistAnalysis(df_hist=weather_data.historic_data,
-                                df_forecast=weather_data.forecast_data
-                                )
-history_analysis = history_analysis.processing()
-history_analysis.get_mean_metrics()
+metrics, df_hist_n_forecast = load_analysis(STATION_CODE, PLACE_CODE, date_year_back, date_today, PATH_HISTORIC_DATA)
 
 
 f"""
 ### Prašomi rezultatai
-- Vidutinė metų temperatūra {round(history_analysis.temp_mean,2)} 
-- Vidutinė metų oro drėgmė {round(history_analysis.humid_mean,2)};
-- Vidutinė dieninė temperatūra {round(history_analysis.temp_mean_day,2)}
-- Vidutitnė naktinė temperatūra {round(history_analysis.temp_mean_night,2)}
-- Savaitgalių su krituliais kiekis {history_analysis.n_weekends_w_precip}
+- Vidutinė metų temperatūra {round(metrics['temp_mean'],2)} 
+- Vidutinė metų oro drėgmė {round(metrics['humid_mean'],2)};
+- Vidutinė dieninė temperatūra {round(metrics['temp_mean_day'],2)}
+- Vidutitnė naktinė temperatūra {round(metrics['temp_mean_night'],2)}
+- Savaitgalių su krituliais kiekis {metrics['n_weekends_w_precip']}
 
 """
 
@@ -123,9 +166,7 @@ st.code(
 )
 
 
-history_analysis=history_analysis.compare_hist_n_forecast(show_figure=False)
-
-st.plotly_chart(history_analysis.fig_hist_n_forecast)
+st.plotly_chart(line_chart_webgl(df_hist_n_forecast, 'Time_LT', 'airTemperature', 'type', title="3 Užduotis:"))
 
 """
 ### 4 užduotis
@@ -133,17 +174,4 @@ st.plotly_chart(history_analysis.fig_hist_n_forecast)
 Prašoma funkcija randasi `utils.py`  bet pridedu ją ir čia:
 """
 
-st.code(
-    """
-    def interpolate_temp(my_series):
-
-        # Number of None values (new values) to insert
-        n = 12 # there are twelve 5 minute intervals in one hour
-    
-        # Creating Series with None values interleaved
-        series_interpolated = pd.Series(np.concatenate([[v] + [None] * n for v in my_series]))
-    
-        series_interpolated=series_interpolated.fillna(np.nan).interpolate()
-        print(series_interpolated.to_string())
-    """
-)
+st.code(inspect.getsource(utils.interpolate_temp) + "\n\n" + inspect.getsource(utils.resample_interpolate))
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregates
+import models
+from benchmarks.fake_api import synthetic_historic_frame
+
+DATE_FROM, DATE_TO = '2024-01-01', '2024-03-31'
+
+
+@pytest.fixture(scope='module')
+def df_hist():
+    return synthetic_historic_frame(['station-000'], DATE_FROM, DATE_TO)
+
+
+def _expected_metrics(df_hist: pd.DataFrame, date_from: str, date_to: str) -> dict:
+    local_dates = df_hist.index.tz_convert(aggregates.LOCAL_TZ).normalize().tz_localize(None)
+    df_window = df_hist[(local_dates >= pd.Timestamp(date_from)) & (local_dates <= pd.Timestamp(date_to))]
+    if df_window.empty:
+        return {'temp_mean': np.nan, 'temp_mean_day': np.nan, 'temp_mean_night': np.nan, 'humid_mean': np.nan,
+                'n_weekends_w_precip': 0}
+    history_analysis = models.HistAnalysis(df_hist=df_window.copy()).processing().get_mean_metrics(verbose=False)
+    return {name: getattr(history_analysis, name) for name in
+            ['temp_mean', 'temp_mean_day', 'temp_mean_night', 'humid_mean', 'n_weekends_w_precip']}
+
+
+@pytest.mark.parametrize('date_from, date_to', [
+    (DATE_FROM, DATE_TO),  # whole history (first and last local day are partial)
+    ('2023-12-01', '2024-01-10'),  # starts before the first day
+    ('2024-03-20', '2024-05-01'),  # ends after the last day
+    ('2024-01-07', '2024-01-14'),  # starts on Sunday, its Saturday is outside the window
+    ('2024-02-10', '2024-02-10'),  # single Saturday
+    ('2024-06-01', '2024-06-30'),  # after the last day
+    ('2023-06-01', '2023-06-30'),  # before the first day
+    ('2024-02-10', '2024-02-01'),  # date_to before date_from
+])
+def test_rollup_index_query_matches_in_memory_analysis(df_hist, date_from, date_to):
+    metrics = aggregates.RollupIndex(df_hist).query(date_from, date_to)
+    expected = _expected_metrics(df_hist, date_from, date_to)
+
+    assert metrics['n_weekends_w_precip'] == expected['n_weekends_w_precip']
+    for name in ['temp_mean', 'temp_mean_day', 'temp_mean_night', 'humid_mean']:
+        np.testing.assert_allclose(metrics[name], expected[name], rtol=1e-12, err_msg=name)
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+import requests
+
+import http_client
+from benchmarks.fake_api import FakeMeteoApi
+
+
+def test_get_session_grows_pool_to_largest_pool_size():
+    session = http_client.get_session(pool_size=2)
+    pool_size = session.get_adapter('http://localhost')._pool_maxsize
+    larger = pool_size + 8
+
+    assert http_client.get_session(pool_size=larger) is session
+    assert http_client.get_session(pool_size=1) is session
+    assert session.get_adapter('http://localhost')._pool_maxsize == larger
+    assert session.get_adapter('https://localhost')._pool_maxsize == larger
+
+
+def test_token_bucket_spaces_requests_evenly():
+    bucket = http_client.TokenBucket(max_requests_per_minute=1200)  # one token per 50 ms
+    bucket.acquire()
+
+    time_start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+
+    assert time.monotonic() - time_start >= 4 * 0.05 * 0.9
+
+
+def test_token_bucket_pause_blocks_acquire():
+    bucket = http_client.TokenBucket(max_requests_per_minute=60000)
+    bucket.pause(0.2)
+
+    assert bucket.acquire() >= 0.2 * 0.9
+
+
+def test_retry_after_seconds_reads_header_or_backs_off():
+    response = requests.Response()
+    response.headers['Retry-After'] = '3'
+    assert http_client.retry_after_seconds(response, attempt=0) == 3
+
+    response.headers['Retry-After'] = 'not a date'
+    assert http_client.retry_after_seconds(response, attempt=1, backoff_base=5) == 10
+    assert http_client.retry_after_seconds(None, attempt=10, backoff_base=5, backoff_max=60) == 60
+
+
+def test_get_retries_after_too_many_requests():
+    bucket = http_client.TokenBucket(max_requests_per_minute=60000)
+    with FakeMeteoApi(error_429_rate=0.5, retry_after=0, seed=1) as api:
+        responses = [http_client.get(f"{api.url}stations/station-0/observations/2024-01-0{day}", bucket=bucket)
+                     for day in range(1, 10)]
+
+    assert [response.status_code for response in responses] == [200] * 9
+    assert api.n_errors_429 > 0
+    assert api.n_requests == 9 + api.n_errors_429
+
+
+def test_get_gives_up_after_max_retries():
+    bucket = http_client.TokenBucket(max_requests_per_minute=60000)
+    with FakeMeteoApi(error_429_rate=1.0, retry_after=0) as api:
+        with pytest.raises(requests.HTTPError) as error:
+            http_client.get(f"{api.url}stations", bucket=bucket, max_retries=2)
+
+    assert error.value.response.status_code == 429
+    assert api.n_requests == 3
+
+
+@pytest.mark.skipif(http_client.fcntl is None, reason="file locks are not available")
+def test_shared_token_bucket_shares_schedule_and_pause_between_instances(tmp_path):
+    path = str(tmp_path / 'quota')
+    bucket, other_bucket = (http_client.SharedTokenBucket(max_requests_per_minute=600, path=path) for _ in range(2))
+
+    bucket.acquire()
+    assert other_bucket.acquire() >= 0.1 * 0.9  # slot after the one reserved by the other instance
+
+    bucket.pause(0.2)
+    assert other_bucket.acquire() >= 0.2 * 0.9
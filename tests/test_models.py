@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import http_client
+import instrumentation
+import models
+import storage
+from benchmarks.fake_api import FakeMeteoApi, synthetic_historic_frame
+
+
+def _observations_day(date: str, condition_code):
+    return [{'observationTimeUtc': f"{date} {hour:02d}:00:00", 'airTemperature': float(hour),
+             'relativeHumidity': 80.0, 'precipitation': 0.0, 'conditionCode': condition_code}
+            for hour in range(24)]
+
+
+def test_observations_to_frame_first_day_without_condition_code():
+    # All conditionCode values of the first day are null (e.g. 2024-05-18 at vilniaus-ams)
+    observations_days = [_observations_day('2024-05-18', None), _observations_day('2024-05-19', 'clear')]
+    observations_days[1][0]['windGust'] = 5.0  # field appearing only on a later day
+
+    df = models.observations_to_frame(observations_days, 'vilniaus-ams')
+
+    assert len(df) == 48
+    assert isinstance(df['conditionCode'].dtype, pd.CategoricalDtype)
+    assert df['conditionCode'].iloc[:24].isna().all()
+    assert (df['conditionCode'].iloc[24:] == 'clear').all()
+    assert df['airTemperature'].dtype == 'float64'
+    assert df['windGust'].notna().sum() == 1 and np.isnan(df['windGust'].iloc[0])
+    assert str(df.index.tz) == 'UTC'
+
+
+def test_get_historic_data_from_parquet_archive_reads_only_own_station(tmp_path):
+    path = str(tmp_path / 'archive')
+    storage.save_frame(synthetic_historic_frame(['a', 'b'], '2024-01-01', '2024-01-03'), path,
+                       partition_cols=['station_code'])
+    weather_data = models.DataMeteo(station_code='a', cache_dir=None, validate=False)
+
+    weather_data.get_historic_data('2024-01-02', '2024-01-03', path_df_from_parquet=path)
+
+    assert len(weather_data.historic_data) == 48
+    assert (weather_data.historic_data['station_code'] == 'a').all()
+
+
+def test_fetch_observations_caches_retrieved_days_and_reports_failed_ones(tmp_path):
+    observation_cache = storage.ObservationCache(cache_dir=str(tmp_path / 'observations'))
+    cassette_dir = str(tmp_path / 'cassettes')
+
+    with FakeMeteoApi() as api:
+        try:
+            http_client.use_cassettes(cassette_dir, mode='record')
+            models.fetch_observations({'station-0': ['2024-01-01']}, api_url=api.url)
+
+            # 2024-01-02 is not recorded, so it fails in replay mode while 2024-01-01 is retrieved and cached
+            http_client.use_cassettes(cassette_dir, mode='replay')
+            with pytest.raises(models.ObservationsIncomplete) as error:
+                models.fetch_observations({'station-0': ['2024-01-01', '2024-01-02']}, api_url=api.url,
+                                          observation_cache=observation_cache)
+            assert error.value.failed_days == [('station-0', '2024-01-02')]
+        finally:
+            http_client.use_cassettes(None)
+
+        # Cached day is served without requests
+        n_requests = api.n_requests
+        observations = models.fetch_observations({'station-0': ['2024-01-01']}, api_url=api.url,
+                                                 observation_cache=observation_cache)
+        assert api.n_requests == n_requests
+
+    assert len(observations['station-0'][0]) == 24
+
+
+def test_get_forecast_data_not_modified_is_taken_from_archive(tmp_path):
+    with FakeMeteoApi() as api:
+        data_meteo = models.DataMeteo(api_url=api.url, place_code='place-000', cache_dir=str(tmp_path),
+                                      validate=False)
+        df_downloaded = data_meteo.get_forecast_data().forecast_data
+
+        hits_key = ('cache_hits', (('cache', 'forecasts'),))
+        n_hits = instrumentation.METRICS.counters.get(hits_key, 0)
+        df_not_modified = data_meteo.get_forecast_data().forecast_data
+
+    assert instrumentation.METRICS.counters.get(hits_key, 0) == n_hits + 1  # answered by 304 Not Modified
+    pd.testing.assert_frame_equal(df_not_modified, df_downloaded)
+    assert len(data_meteo.forecast_archive.read(place_codes=['place-000'])) == len(df_downloaded)
+
+
+@pytest.mark.parametrize('chunk_rows', [100, 24 * 31, 10 ** 6])
+def test_analyze_archive_equals_in_memory_analysis(tmp_path, chunk_rows):
+    df = synthetic_historic_frame(['a', 'b'], '2023-12-20', '2024-03-10')
+    df.iloc[::37, df.columns.get_loc('airTemperature')] = np.nan
+    path = str(tmp_path / 'observations')
+    storage.save_frame(df, path, partition_cols=['station_code'])
+    df = storage.read_frame(path)  # values as stored
+
+    expected = {station_code: models.HistAnalysis(df_hist=df_station.drop(columns='station_code'))
+                .processing().get_mean_metrics(verbose=False).get_metrics_dict()
+                for station_code, df_station in df.groupby('station_code', observed=True)}
+    expected = pd.DataFrame.from_dict(expected, orient='index').rename_axis('station_code')
+
+    metrics = models.analyze_archive(path, chunk_rows=chunk_rows)
+
+    # Partial sums are merged exactly, so chunked results are equal and not only close
+    pd.testing.assert_frame_equal(metrics.loc[expected.index], expected, check_exact=True, check_index_type=False)
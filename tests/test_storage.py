@@ -0,0 +1,71 @@
+import datetime
+
+import pyarrow.dataset as ds
+
+import storage
+from benchmarks.fake_api import synthetic_historic_frame
+
+
+def test_is_day_complete_waits_for_late_observations():
+    now = datetime.datetime(2024, 1, 2, 2, 0, tzinfo=datetime.timezone.utc)
+
+    assert not storage.is_day_complete('2024-01-01', now=now)
+    assert storage.is_day_complete('2024-01-01', now=now + storage.DAY_COMPLETE_AFTER)
+
+
+def test_observation_cache_serves_only_complete_days(tmp_path):
+    observation_cache = storage.ObservationCache(cache_dir=str(tmp_path))
+    today = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+    observations = [{'observationTimeUtc': '2024-01-01 00:00:00', 'airTemperature': -1.5}]
+
+    assert observation_cache.get('station-0', '2024-01-01') is None
+    observation_cache.put('station-0', '2024-01-01', observations)
+    observation_cache.put('station-0', today, observations)
+
+    assert observation_cache.get('station-0', '2024-01-01') == observations
+    assert observation_cache.get('station-0', today) is None  # still receiving observations, fetched again
+    assert observation_cache.get('station-1', '2024-01-01') is None
+
+
+def test_upsert_frame_multi_station_file_keeps_all_stations(tmp_path):
+    path = str(tmp_path / 'observations.parquet')
+    df = synthetic_historic_frame(['a', 'b'], '2024-01-01', '2024-01-03')
+
+    storage.upsert_frame(df, path, key_columns=['station_code'])
+    storage.upsert_frame(df, path, key_columns=['station_code'])
+
+    df_saved = storage.read_frame(path)
+    assert len(df_saved) == len(df) == 144
+    assert df_saved.groupby('station_code', observed=True).size().to_dict() == {'a': 72, 'b': 72}
+
+
+def test_upsert_frame_replaces_overlapping_rows_of_partitions(tmp_path):
+    path = str(tmp_path / 'archive')
+    storage.upsert_frame(synthetic_historic_frame(['a', 'b'], '2024-01-01', '2024-01-10'), path,
+                         partition_cols=['station_code'])
+    df_new = synthetic_historic_frame(['a'], '2024-01-08', '2024-01-12')
+    df_new['airTemperature'] = 100.0
+    storage.upsert_frame(df_new, path, partition_cols=['station_code'])
+    storage.upsert_frame(df_new, path, partition_cols=['station_code'])
+
+    df_saved = storage.read_frame(path)
+    df_a = df_saved.loc[df_saved['station_code'] == 'a']
+    assert not df_a.index.duplicated().any()
+    assert len(df_a) == 12 * 24 and (df_saved['station_code'] == 'b').sum() == 10 * 24
+    assert (df_a.loc['2024-01-08':, 'airTemperature'] == 100).all()
+    assert (df_a.loc[:'2024-01-07', 'airTemperature'] != 100).all()
+
+
+
+def test_read_frame_pushes_down_time_range_and_filters(tmp_path):
+    path = str(tmp_path / 'archive')
+    storage.save_frame(synthetic_historic_frame(['a', 'b'], '2024-01-01', '2024-03-31'), path,
+                       partition_cols=['station_code'])
+
+    df = storage.read_frame(path, columns=['airTemperature'], date_from='2024-02-01', date_to='2024-02-29',
+                            filters=ds.field('station_code') == 'b')
+
+    assert len(df) == 29 * 24
+    assert str(df.index.min()) == '2024-02-01 00:00:00+00:00' and str(df.index.max()) == '2024-02-29 23:00:00+00:00'
+    assert list(df.columns) == ['airTemperature']
+    assert df['airTemperature'].dtype == 'float32'
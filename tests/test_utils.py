@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+import utils
+from benchmarks.fake_api import synthetic_historic_frame
+
+
+def test_interpolate_temp_accepts_unnamed_series():
+    series = pd.Series([0.0, 12.0], index=pd.date_range('2024-01-01', periods=2, freq='h', tz='UTC'))
+
+    result = utils.interpolate_temp(series)
+
+    assert result.name is None
+    assert len(result) == 13 and result.iloc[6] == 6.0
+
+
+def test_iter_resample_interpolate_matches_unchunked_across_missing_values():
+    df = synthetic_historic_frame(['a'], '2024-01-01', '2024-01-10')[['airTemperature', 'relativeHumidity']]
+    # 6 hour gap of temperature across the chunk boundary at 2024-01-03 and leading missing humidity
+    df.loc['2024-01-02 21:00':'2024-01-03 03:00', 'airTemperature'] = np.nan
+    df.loc[:'2024-01-01 05:00', 'relativeHumidity'] = np.nan
+
+    expected = utils.resample_interpolate(df, freq='15min')
+    chunked = pd.concat(df_chunk for _, df_chunk in utils.iter_resample_interpolate(df, freq='15min', chunk='1D'))
+
+    pd.testing.assert_frame_equal(chunked, expected, check_freq=False)
@@ -1,25 +1,23 @@
+import functools
 import math
+from zoneinfo import ZoneInfo
 
 import numpy as np
 import pandas as pd
-import requests
 
+import locations
 
-def validate_location_code(location_code: str, location_type:str):
+
+def validate_location_code(location_code: str, location_type:str, api_url:str = 'https://api.meteo.lt/v1/'):
     """
     Validuoja lokacijos kodą, priklausomai nuo imammų duomenų (prognozės ar istoriniai)
     :param location_code: identifikacinis vietovės kodas
     :param location_type: 'station' arba place
+    :param api_url: API root url
     :return: location_code
     """
-    # Getting valid codes
-    if location_type == 'station':
-        valid_location_codes = requests.get("https://api.meteo.lt/v1/stations").json()
-        valid_location_codes = [x['code'] for x in valid_location_codes]
-    elif location_type == 'place':
-        valid_location_codes = requests.get("https://api.meteo.lt/v1/places").json()
-        valid_location_codes = [x['code'] for x in valid_location_codes]
-
+    # Getting valid codes from the catalog (downloaded once and cached on disk)
+    catalog = locations.get_catalog(api_url)
 
     mapping_codes_w_contexts={
         "station":"historic",
@@ -29,12 +27,12 @@ def validate_location_code(location_code: str, location_type:str):
     if location_code is None:
         print(f"The {location_type}_code is not defined.\n" 
         f"If you want to get {mapping_codes_w_contexts[location_type]} data, define one of the following {location_type} codes:"
-        f"{valid_location_codes}")
+        f"{catalog.codes(location_type)}")
 
-    elif location_code not in valid_location_codes:
+    elif not catalog.is_valid(location_code, location_type):
         print(
             f"""Invalid {location_type}_code: does not exist.
-             Select one of the following {location_type} codes: {valid_location_codes}""")
+             Select one of the following {location_type} codes: {catalog.codes(location_type)}""")
     else:
         return  location_code
 
@@ -65,15 +63,250 @@ def interpolate_temp(my_series):
 
     """
     4 Užduotis
-    Algoritmas; pridėti paplidomas none vertes, kad gautume 5min intervalus ir jas užpildome su interpolate funkcija
-    :param my_series: pd.Series su numeriniais duomenimis
-    :return: None
+    Algoritmas; hourly series upsampled to 5min intervals, new values filled with linear interpolation in time
+    (see resample_interpolate)
+    :param my_series: pd.Series su numeriniais duomenimis ir pd.DatetimeIndex
+    :return: pd.Series with 5 min pd.DatetimeIndex
+    """
+    return resample_interpolate(my_series, freq='5min').iloc[:, 0].rename(my_series.name)
+
+
+def resample_interpolate(df, freq: str = '5min', columns: list = None) -> pd.DataFrame:
+    """
+    Upsamples numeric columns to given frequency, values between observations are interpolated linearly in time.
+    Interpolation runs on float64 NumPy arrays (np.interp over int64 timestamps) for each column.
+    :param df: pd.DataFrame or pd.Series with pd.DatetimeIndex,
+        or pd.DataFrame indexed by (location, time) - each location is resampled separately
+    :param freq: target frequency, e.g. '5min', '1min'
+    :param columns: columns to resample, all numeric columns by default
+    :return: pd.DataFrame indexed the same way as df, with the new time grid
+    """
+    if isinstance(df, pd.Series):
+        df = df.to_frame(name=df.name if df.name is not None else 0)
+    if isinstance(df.index, pd.MultiIndex):
+        frames = {location: resample_interpolate(df_location.droplevel(0), freq=freq, columns=columns)
+                  for location, df_location in df.groupby(level=0, sort=False)}
+        return pd.concat(frames, names=[df.index.names[0]])
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise TypeError("resample_interpolate requires pd.DatetimeIndex")
+
+    if columns is None:
+        columns = [column for column in df.columns
+                   if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column])]
+    df = df[columns].sort_index()
+    df = df[~df.index.duplicated(keep='last')]
+
+    index = df.index.as_unit('ns')
+    if index.empty:
+        return pd.DataFrame(columns=columns, index=index, dtype='float64')
+    index_new = pd.date_range(index[0].ceil(freq), index[-1].floor(freq), freq=freq, name=index.name).as_unit('ns')
+
+    x = index_new.asi8
+    xp = index.asi8
+    data = {}
+    for column in columns:
+        fp = df[column].to_numpy(dtype='float64', na_value=np.nan)
+        valid = ~np.isnan(fp)
+        data[column] = np.interp(x, xp[valid], fp[valid], left=np.nan, right=np.nan) if valid.any() \
+            else np.full(len(x), np.nan)
+
+    return pd.DataFrame(data, index=index_new)
+
+
+def iter_resample_interpolate(df, freq: str = '5min', columns: list = None, chunk: str = '30D'):
+    """
+    Chunked version of resample_interpolate for long (multi-year, multi-station) series.
+    Output is produced per location and time chunk, so memory is bounded by the chunk size instead of the total length.
+    Each chunk is resampled together with the nearest valid observations of each column before and after it,
+    so the chunks join into the same series as resample_interpolate returns.
+    :param df: pd.DataFrame or pd.Series with pd.DatetimeIndex, or pd.DataFrame indexed by (location, time)
+    :param freq: target frequency, e.g. '5min', '1min'
+    :param columns: columns to resample, all numeric columns by default
+    :param chunk: time span of one chunk
+    :return: generator of (location, pd.DataFrame) - location is None for single location input
+    """
+    if isinstance(df, pd.Series):
+        df = df.to_frame(name=df.name if df.name is not None else 0)
+    if isinstance(df.index, pd.MultiIndex):
+        locations_frames = ((location, df_location.droplevel(0))
+                            for location, df_location in df.groupby(level=0, sort=False))
+    else:
+        locations_frames = [(None, df)]
+
+    for location, df_location in locations_frames:
+        df_location = df_location.sort_index()
+        df_location = df_location[~df_location.index.duplicated(keep='last')]
+        index = df_location.index
+        if index.empty:
+            continue
+        columns_location = columns if columns is not None else [
+            column for column in df_location.columns if pd.api.types.is_numeric_dtype(df_location[column])
+            and not pd.api.types.is_bool_dtype(df_location[column])]
+        # Positions of valid values of each column, columns without any are left NaN anyway
+        valid_positions = [np.flatnonzero(~np.isnan(df_location[column].to_numpy(dtype='float64', na_value=np.nan)))
+                           for column in columns_location]
+        valid_positions = [positions for positions in valid_positions if len(positions)]
+
+        chunk_starts = pd.date_range(index[0].ceil(freq), index[-1].floor(freq), freq=chunk)
+        for chunk_start in chunk_starts:
+            chunk_end = chunk_start + pd.Timedelta(chunk)
+            # Including one observation before and after the chunk to interpolate up to its boundaries,
+            # and further back and forward up to the nearest valid value of each column
+            position_before = index.searchsorted(chunk_start, side='right') - 1
+            position_after = index.searchsorted(chunk_end, side='left')
+            position_from = max(position_before, 0)
+            position_to = position_after + 1
+            for positions in valid_positions:
+                i = positions.searchsorted(position_before, side='right') - 1
+                if i >= 0:
+                    position_from = min(position_from, positions[i])
+                i = positions.searchsorted(position_after, side='left')
+                if i < len(positions):
+                    position_to = max(position_to, positions[i] + 1)
+            df_chunk = resample_interpolate(df_location.iloc[position_from:position_to], freq=freq,
+                                            columns=columns_location)
+            yield location, df_chunk.loc[(df_chunk.index >= chunk_start) & (df_chunk.index < chunk_end)]
+
+
+def slice_time(df: pd.DataFrame, time_from=None, time_to=None) -> pd.DataFrame:
+    """
+    Rows of [time_from, time_to) found by binary search on sorted pd.DatetimeIndex (sorted first if needed)
+    :param df: pd.DataFrame with tz-aware pd.DatetimeIndex
+    :param time_from: lower range (inclusive), tz-naive values are treated as UTC
+    :param time_to: upper range (exclusive), tz-naive values are treated as UTC
+    :return: pd.DataFrame, slice of df
+    """
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    position_from = df.index.searchsorted(_to_utc(time_from), side='left') if time_from is not None else 0
+    position_to = df.index.searchsorted(_to_utc(time_to), side='left') if time_to is not None else len(df)
+    return df.iloc[position_from:position_to]
+
+
+def align_hist_n_forecast(df_hist: pd.DataFrame, df_forecast: pd.DataFrame, time_from=None, time_to=None,
+                          variables: list = None, tolerance: str = '30min') -> pd.DataFrame:
+    """
+    Nearest timestamp join of observations to forecasts within a window.
+    Both frames are sliced by binary search on their sorted time index, so the cost is O(log n + window).
+    :param df_hist: observations with tz-aware pd.DatetimeIndex
+    :param df_forecast: forecast with tz-aware pd.DatetimeIndex
+    :param time_from: lower range of the window (inclusive), start of forecast by default
+    :param time_to: upper range of the window (exclusive), end of forecast by default
+    :param variables: variables to align, default ['airTemperature']
+    :param tolerance: maximum distance between forecast and observation timestamps
+    :return: pd.DataFrame indexed by forecast time with <variable>_forecast, <variable>_observed columns
+        and observationTimeUtc of the joined observation
     """
-    # Number of None values (new values) to insert
-    n = 11 # there are twelve 5 minute intervals in one hour. There's already one value so adding 11 instead
+    variables = variables or ['airTemperature']
+    tolerance = pd.Timedelta(tolerance)
+
+    df_f = slice_time(df_forecast, time_from, time_to)
+    if df_f.empty:
+        columns = [f"{variable}_{kind}" for variable in variables for kind in ('forecast', 'observed')]
+        return pd.DataFrame(columns=columns + ['observationTimeUtc'], index=df_f.index)
+
+    # Observations needed for the window, including those just outside of it within the tolerance
+    df_h = slice_time(df_hist, df_f.index[0] - tolerance, df_f.index[-1] + tolerance + pd.Timedelta(1, 'ns'))
+
+    forecast = pd.DataFrame({f"{variable}_forecast": df_f[variable].to_numpy(dtype='float64', na_value=np.nan)
+                             for variable in variables})
+    forecast['time'] = df_f.index.tz_convert('UTC').as_unit('ns')
+    observed = pd.DataFrame({f"{variable}_observed": df_h[variable].to_numpy(dtype='float64', na_value=np.nan)
+                             for variable in variables})
+    observed['observationTimeUtc'] = df_h.index.tz_convert('UTC').as_unit('ns')
+
+    df = pd.merge_asof(forecast, observed, left_on='time', right_on='observationTimeUtc',
+                       direction='nearest', tolerance=tolerance)
+    return df.set_index(pd.DatetimeIndex(df.pop('time'), name=df_f.index.name))
+
+
+def downsample_lttb(series: pd.Series, n_out: int = 2000) -> pd.Series:
+    """
+    Largest-Triangle-Three-Buckets downsampling for plotting: keeps n_out points preserving the visual shape
+    (peaks and troughs) of the line
+    :param series: numeric pd.Series with pd.DatetimeIndex (or numeric index), missing values are dropped
+    :param n_out: number of points to keep
+    :return: pd.Series, subset of series
+    """
+    series = series.dropna().sort_index()
+    n = len(series)
+    if n_out >= n or n_out < 3:
+        return series
+
+    index = series.index
+    x = (index.asi8 if isinstance(index, pd.DatetimeIndex) else index.to_numpy()).astype('float64')
+    y = series.to_numpy(dtype='float64')
+
+    # First and last points are kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+    selected = np.empty(n_out, dtype='int64')
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        x_next, y_next = x[end:next_end].mean(), y[end:next_end].mean()
+
+        # Point of the bucket forming the largest triangle with the previous selected point and next bucket average
+        area = np.abs((x[a] - x_next) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (y_next - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+
+    return series.iloc[selected]
+
+
+@functools.lru_cache(maxsize=8)
+def hourly_calendar(year_from: int, year_to: int) -> pd.DataFrame:
+    """
+    Hourly calendar dimension of local (Europe/Vilnius) time, built once per span of UTC years.
+    Rows are UTC hours, so row of a timestamp is found by integer offset (see calendar_for_index)
+    :param year_from: first UTC year (inclusive)
+    :param year_to: last UTC year (inclusive)
+    :return: pd.DataFrame indexed by UTC hour with Time_LT_date (datetime.date), Time_LT_is_daytime,
+        Time_LT_is_weekend and Time_LT_week (int, number of Monday-Sunday week since 1970)
+    """
+    index = pd.date_range(f"{year_from}-01-01", f"{year_to + 1}-01-01", freq='h', tz='UTC', inclusive='left')
+    time_lt = index.tz_convert(ZoneInfo("Europe/Vilnius")).tz_localize(None)  # local wall time, converted once
+
+    day_number = time_lt.normalize().as_unit('ns').asi8 // (86400 * 10 ** 9)
+    return pd.DataFrame({
+        'Time_LT_date': time_lt.date,
+        'Time_LT_is_daytime': (time_lt.hour >= 8) & (time_lt.hour <= 20),
+        'Time_LT_is_weekend': time_lt.dayofweek > 4,
+        'Time_LT_week': (day_number + 3) // 7,  # 1970-01-01 was Thursday
+    }, index=index)
+
+
+def calendar_for_index(time_index: pd.DatetimeIndex) -> dict:
+    """
+    Gathers calendar features of each timestamp from the cached hourly_calendar by integer offset
+    :param time_index: tz-aware pd.DatetimeIndex
+    :return: dict of np.array per calendar column, aligned with time_index.
+        Missing timestamps (NaT) have no date, week -1 and are neither daytime nor weekend
+    """
+    time_utc = time_index.tz_convert('UTC')
+    is_valid = ~np.asarray(time_utc.isna())
+    if not is_valid.all() or not len(time_utc):
+        n = len(time_utc)
+        features = {
+            'Time_LT_date': np.full(n, None, dtype=object),
+            'Time_LT_is_daytime': np.zeros(n, dtype=bool),
+            'Time_LT_is_weekend': np.zeros(n, dtype=bool),
+            'Time_LT_week': np.full(n, -1, dtype='int64'),
+        }
+        if is_valid.any():
+            for column, values in calendar_for_index(time_index[is_valid]).items():
+                features[column][is_valid] = values
+        return features
+
+    # Span is widened to whole decades, so chunks of a long history share one cached calendar
+    calendar = hourly_calendar(int(time_utc.min().year) // 10 * 10, int(time_utc.max().year) // 10 * 10 + 9)
+
+    offsets = (time_utc.as_unit('ns').asi8 - calendar.index[0].value) // (3600 * 10 ** 9)
+    return {column: calendar[column].to_numpy()[offsets] for column in calendar.columns}
 
-    # Creating Series with None values interleaved
-    series_interpolated = pd.Series(np.concatenate([[v] + [None] * n for v in my_series]))
 
-    series_interpolated=series_interpolated.fillna(np.nan).interpolate()
-    print(series_interpolated.head(50).to_string())
\ No newline at end of file
+def _to_utc(value) -> pd.Timestamp:
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')